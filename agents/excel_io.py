@@ -0,0 +1,302 @@
+# agents/excel_io.py
+
+import io
+import logging
+import math
+import numbers
+import os
+import zipfile
+from itertools import chain
+from xml.sax.saxutils import escape
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+
+logger = logging.getLogger(__name__)
+
+SHEET_XML_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+)
+SHEET_XML_TAIL = '</sheetData></worksheet>'
+
+
+def _iter_values(ws):
+    """Stream the values of a read-only worksheet row by row."""
+    # The stored <dimension> is not trusted (other writers leave stale or no
+    # records, and read-only iteration stops at it): scan the sheet once for
+    # its real size, so every row is read and padded to the full sheet width
+    ws.reset_dimensions()
+    try:
+        ws.calculate_dimension(force=True)
+    except UnboundLocalError:  # openpyxl cannot size a sheet without any rows
+        return iter(())
+    return ws.iter_rows(values_only=True)
+
+
+def _dimension_ref(header, rows):
+    """The "A1:<last cell>" extent of a sheet whose rows are in memory (None when unknown or empty)."""
+    if not isinstance(rows, (list, tuple)):
+        return None
+    height = len(rows) + (1 if header else 0)
+    width = max(len(header), max(map(len, rows), default=0))
+    if not (height and width):
+        return None
+    return f"A1:{get_column_letter(width)}{height}"
+
+
+def _split_header(rows):
+    """(header, rows) from a list of sheet rows."""
+    if not rows:
+        return (), []
+    return rows[0], rows[1:]
+
+
+def read_sheet(path, sheet_name=None):
+    """Read one sheet (the active one by default) as (header, rows) of plain value tuples."""
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name else wb.active
+        rows = list(_iter_values(ws))
+    finally:
+        wb.close()
+    return _split_header(rows)
+
+
+def iter_sheet(path, sheet_name=None):
+    """
+    Stream one sheet's rows (header first) as plain value tuples without
+    materializing the sheet; the read-only handle closes once exhausted.
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name else wb.active
+        yield from _iter_values(ws)
+    finally:
+        wb.close()
+
+
+def read_workbook(path):
+    """Read every sheet as {sheet_name: (header, rows)}, in workbook order."""
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return {ws.title: _split_header(list(_iter_values(ws))) for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+
+def _cell_xml(ref, value):
+    """
+    Render one cell as sheet XML (numbers inline, everything else as inline
+    strings). NaN and infinities have no spreadsheet form and stay empty.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, numbers.Number):  # NumPy scalars included
+        if not math.isfinite(value):
+            return ""
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    text = escape(ILLEGAL_CHARACTERS_RE.sub("", str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _write_sheet_xml(out, header, rows, ref=None):
+    """Stream a header + rows as raw <sheetData> XML into a text stream."""
+    letters = []
+    out.write(SHEET_XML_HEAD)
+    if ref:
+        out.write(f'<dimension ref="{ref}"/>')
+    out.write('<sheetData>')
+    for r, row in enumerate(chain((header,), rows) if header else rows, start=1):
+        while len(letters) < len(row):
+            letters.append(get_column_letter(len(letters) + 1))
+        cells = "".join(_cell_xml(f"{col}{r}", v) for col, v in zip(letters, row))
+        out.write(f'<row r="{r}">{cells}</row>')
+    out.write(SHEET_XML_TAIL)
+
+
+def _splice_sheets(src_path, dst_path, xml_parts):
+    """Copy a saved .xlsx, replacing some worksheet parts with hand-written sheet XML."""
+    with zipfile.ZipFile(src_path) as src, \
+            zipfile.ZipFile(dst_path, "w", zipfile.ZIP_DEFLATED) as dst:
+        for info in src.infolist():
+            if info.filename not in xml_parts:
+                dst.writestr(info, src.read(info))
+                continue
+            header, rows, ref = xml_parts[info.filename]
+            with io.TextIOWrapper(dst.open(info.filename, "w"), encoding="utf-8") as out:
+                _write_sheet_xml(out, header, rows, ref)
+
+
+def _save_workbook(target, sheets, xml_sheets, refs=None):
+    """
+    Write all sheets into `target` (see write_workbook). Each sheet gets a
+    <dimension> record when its extent is known (from `refs` or from rows
+    held in memory), so later read-only loads need not scan it for its size.
+    """
+    wb = Workbook(write_only=True)
+    raw_sheets = {}
+    for name, (header, rows) in sheets.items():
+        ws = wb.create_sheet(name)
+        ref = (refs or {}).get(name) or _dimension_ref(header, rows)
+        if name in xml_sheets:
+            raw_sheets[name] = (ws, header, rows, ref)
+            continue
+        if ref:
+            # The write-only writer emits <dimension> only when the sheet can
+            # report one, and it asks before the first row goes out
+            ws.calculate_dimension = lambda ref=ref: ref
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+
+    if not raw_sheets:
+        wb.save(target)
+        return
+
+    skeleton = target + ".part"
+    wb.save(skeleton)
+    try:
+        _splice_sheets(skeleton, target, {
+            ws.path.lstrip("/"): (header, rows, ref)
+            for ws, header, rows, ref in raw_sheets.values()
+        })
+    finally:
+        os.remove(skeleton)
+
+
+def write_workbook(path, sheets, xml_sheets=()):
+    """
+    Write {sheet_name: (header, rows)} into a fresh write-only workbook.
+    Rows are streamed straight to disk, no Cell objects are kept in memory.
+    Sheets named in `xml_sheets` skip openpyxl entirely: their XML is written
+    by hand and spliced into the saved file (meant for very large sheets).
+    The file is written next to `path` first and then swapped in atomically.
+    """
+    tmp_path = path + ".tmp"
+    _save_workbook(tmp_path, sheets, xml_sheets)
+    os.replace(tmp_path, path)
+
+
+def update_workbook(path, sheets, xml_sheets=(), drop=()):
+    """
+    Rewrite the workbook at `path` with `sheets` replacing (or being added to)
+    its existing sheets, and the sheets named in `drop` left out. Untouched
+    sheets are streamed over value-by-value from the original file, which
+    stays intact until the new one is complete.
+    """
+    tmp_path = path + ".tmp"
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        merged = {}
+        refs = {}
+        for ws in wb.worksheets:
+            if ws.title in drop:
+                continue
+            if ws.title in sheets:
+                merged[ws.title] = sheets[ws.title]
+                continue
+            rows = _iter_values(ws)
+            merged[ws.title] = (next(rows, ()), rows)
+            if ws.max_row and ws.max_column:
+                refs[ws.title] = f"A1:{get_column_letter(ws.max_column)}{ws.max_row}"
+
+        for name, sheet in sheets.items():
+            merged.setdefault(name, sheet)
+
+        _save_workbook(tmp_path, merged, xml_sheets, refs)
+    finally:
+        wb.close()
+    os.replace(tmp_path, path)
+
+
+class WorkbookFile:
+    """The shared invoices workbook on disk; every update rewrites the file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def location(self):
+        """Where updates end up, for progress messages."""
+        return self.path
+
+    def sheet_names(self):
+        wb = load_workbook(self.path, read_only=True)
+        try:
+            return wb.sheetnames
+        finally:
+            wb.close()
+
+    def read(self, sheet_name):
+        return read_sheet(self.path, sheet_name)
+
+    def stream(self, sheet_name):
+        """(header, row iterator) for one sheet, read lazily."""
+        rows = iter_sheet(self.path, sheet_name)
+        return next(rows, ()), rows
+
+    def write(self, sheets, xml_sheets=()):
+        write_workbook(self.path, sheets, xml_sheets)
+
+    def update(self, sheets, xml_sheets=(), drop=()):
+        update_workbook(self.path, sheets, xml_sheets, drop)
+
+
+class InMemoryWorkbook(WorkbookFile):
+    """
+    Same interface as WorkbookFile, but sheets stay in memory between
+    pipeline stages and reach the disk only once, through save().
+    An existing file at `path` is loaded on first use.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.sheets = None
+        self.xml_sheets = set()
+
+    def _loaded(self):
+        if self.sheets is None:
+            self.sheets = read_workbook(self.path) if os.path.exists(self.path) else {}
+        return self.sheets
+
+    def exists(self):
+        return bool(self._loaded())
+
+    def location(self):
+        return f"{self.path} (held in memory, written when the pipeline finishes)"
+
+    def sheet_names(self):
+        return list(self._loaded())
+
+    def read(self, sheet_name):
+        return self._loaded()[sheet_name]
+
+    def stream(self, sheet_name):
+        header, rows = self.read(sheet_name)
+        return header, iter(rows)
+
+    def write(self, sheets, xml_sheets=()):
+        self.sheets = {}
+        self.xml_sheets = set()
+        self.update(sheets, xml_sheets)
+
+    def update(self, sheets, xml_sheets=(), drop=()):
+        loaded = self._loaded()
+        for name in drop:
+            loaded.pop(name, None)
+            self.xml_sheets.discard(name)
+        for name, (header, rows) in sheets.items():
+            loaded[name] = (tuple(header), list(rows))
+        self.xml_sheets.update(xml_sheets)
+
+    def save(self):
+        """Write all sheets out in one go (no-op if nothing was loaded or changed)."""
+        if self.sheets:
+            write_workbook(self.path, self.sheets, self.xml_sheets)
+            logger.info("📁 Workbook saved to %s", self.path)
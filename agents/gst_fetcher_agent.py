@@ -1,15 +1,33 @@
 # agents/gst_fetcher_agent.py
 
+import logging
 import os
 import re
-import json
-import requests
-from bs4 import BeautifulSoup
-from openpyxl import load_workbook
+import orjson
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import lxml.html
+
+try:
+    from agents.excel_io import WorkbookFile
+except ImportError:  # run as a script from agents/
+    from excel_io import WorkbookFile
+
+logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.join("data", "outputs")
 EXCEL_FILE = os.path.join(BASE_DIR, "invoices_data.xlsx")
 HSN_MAP_FILE = os.path.join("data", "local_cache", "hsn_gst_map.json")
+# On-disk HTTP cache (SQLite) for VakilSearch pages, so reruns don't hit the network
+HTTP_CACHE_FILE = os.path.join("data", "local_cache", "http_cache")
+HTTP_CACHE_EXPIRY = timedelta(days=30)
+
+# Max concurrent HSN lookups against VakilSearch
+FETCH_WORKERS = 16
 
 # --- fallback HSN → GST mapping ---
 HSN_FALLBACK = {
@@ -18,28 +36,56 @@ HSN_FALLBACK = {
     # Add more as needed...
 }
 
+GST_FETCH_HEADER = (
+    "DocNo", "DocDt", "HSN", "Item Description",
+    "GST_Rate (%)", "CGST_Rate (%)", "SGST_Rate (%)", "Source"
+)
+
+
+def _cell_text(cell):
+    """Text of a table cell, each fragment stripped (same as bs4 get_text(strip=True))."""
+    return "".join(part.strip() for part in cell.itertext())
+
 
 class GSTFetcherAgent:
-    def __init__(self, excel_file=EXCEL_FILE, hsn_map_file=HSN_MAP_FILE):
-        self.excel_file = excel_file
+    def __init__(self, excel_file=EXCEL_FILE, hsn_map_file=HSN_MAP_FILE, workbook=None):
+        self.workbook = workbook or WorkbookFile(excel_file)
+        self.excel_file = self.workbook.path
         self.hsn_map_file = hsn_map_file
         self.hsn_cache = self._load_hsn_cache()
+        self._cache_lock = threading.Lock()
+        self.session = self._create_session()
 
     def _load_hsn_cache(self):
         """Load HSN → GST mapping from JSON file, merged with fallback dict."""
         if os.path.exists(self.hsn_map_file):
             try:
-                with open(self.hsn_map_file, "r", encoding="utf-8") as f:
-                    return {**HSN_FALLBACK, **json.load(f)}
+                with open(self.hsn_map_file, "rb") as f:
+                    return {**HSN_FALLBACK, **orjson.loads(f.read())}
             except Exception:
                 return dict(HSN_FALLBACK)
         return dict(HSN_FALLBACK)
 
+    def _create_session(self):
+        """
+        One keep-alive session for all lookups (reuses the TCP/TLS connection),
+        backed by a persistent HTTP cache and retrying transient 5xx errors.
+        """
+        os.makedirs(os.path.dirname(HTTP_CACHE_FILE), exist_ok=True)
+        session = requests_cache.CachedSession(HTTP_CACHE_FILE, expire_after=HTTP_CACHE_EXPIRY)
+        session.headers.update({"User-Agent": "Mozilla/5.0"})
+
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=FETCH_WORKERS)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
     def _save_hsn_cache(self):
         """Save updated HSN cache to JSON file."""
         os.makedirs(os.path.dirname(self.hsn_map_file), exist_ok=True)
-        with open(self.hsn_map_file, "w", encoding="utf-8") as f:
-            json.dump(self.hsn_cache, f, indent=4, ensure_ascii=False)
+        with open(self.hsn_map_file, "wb") as f:
+            f.write(orjson.dumps(self.hsn_cache, option=orjson.OPT_INDENT_2))
 
     def _fetch_gst_details(self, hsn: str):
         """
@@ -54,18 +100,19 @@ class GSTFetcherAgent:
         url = f"https://vakilsearch.com/hsn-code/search/{hsn}"
         gst_rate, description = None, None
         try:
-            resp = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=10)
+            resp = self.session.get(url, timeout=(3.05, 10))
             if resp.status_code == 200:
-                soup = BeautifulSoup(resp.text, "html.parser")
+                # lxml parses the raw bytes directly (no decode, no soup tree)
+                tree = lxml.html.fromstring(resp.content)
 
                 # ✅ Parse table row: HSN | Description | GST%
-                for row in soup.find_all("tr"):
-                    cols = row.find_all("td")
+                for row in tree.xpath("//tr"):
+                    cols = row.xpath(".//td")
                     if len(cols) >= 3:
-                        hsn_code = cols[0].get_text(strip=True)
+                        hsn_code = _cell_text(cols[0])
                         if hsn_code == hsn:  # exact match
-                            description = cols[1].get_text(strip=True) if len(cols) > 1 else None
-                            rate_text = cols[2].get_text(strip=True) if len(cols) > 2 else None
+                            description = _cell_text(cols[1]) if len(cols) > 1 else None
+                            rate_text = _cell_text(cols[2]) if len(cols) > 2 else None
 
                             if rate_text:
                                 match = re.search(r"(\d{1,2})", rate_text)
@@ -75,14 +122,15 @@ class GSTFetcherAgent:
 
                 # ✅ Save to cache if found
                 if gst_rate:
-                    self.hsn_cache[hsn] = {
-                        "gst_rate": gst_rate,
-                        "description": description
-                    }
+                    with self._cache_lock:
+                        self.hsn_cache[hsn] = {
+                            "gst_rate": gst_rate,
+                            "description": description
+                        }
                     return gst_rate, description, url
 
         except Exception as e:
-            print(f"⚠ Error fetching GST for HSN {hsn}: {e}")
+            logger.warning("⚠ Error fetching GST for HSN %s: %s", hsn, e)
 
         # ✅ Step 2: Fallback dictionary
         if hsn in HSN_FALLBACK:
@@ -92,42 +140,48 @@ class GSTFetcherAgent:
         return None, None, "Not Found"
 
     def process(self):
-        if not os.path.exists(self.excel_file):
-            print(f"❌ Invoice file not found: {self.excel_file}")
+        if not self.workbook.exists():
+            logger.error("❌ Invoice file not found: %s", self.excel_file)
             return
 
-        wb = load_workbook(self.excel_file)
-        ws_summary = wb["Invoice_Summary"]
-        ws_qr = wb["QR_Meta"]
+        _, summary_rows = self.workbook.read("Invoice_Summary")
+        _, qr_rows = self.workbook.read("QR_Meta")
 
-        # Reset GST_Fetch sheet if exists
-        if "GST_Fetch" in wb.sheetnames:
-            del wb["GST_Fetch"]
-        ws_gst = wb.create_sheet("GST_Fetch")
-        ws_gst.append([
-            "DocNo", "DocDt", "HSN", "Item Description",
-            "GST_Rate (%)", "CGST_Rate (%)", "SGST_Rate (%)", "Source"
-        ])
+        gst_rows = []
+        missing_hsn = 0
 
         # Build HSN lookup (DocNo → HSN)
-        hsn_lookup = {}
-        for row in ws_qr.iter_rows(min_row=2, values_only=True):
-            docno, seller, buyer, doctype, docdt, totinv, itemcnt, mainhsn, irn, irndt, raw = row
-            if docno and mainhsn:
-                hsn_lookup[docno] = str(mainhsn)
+        hsn_lookup = {
+            docno: str(mainhsn)
+            for docno, seller, buyer, doctype, docdt, totinv, itemcnt, mainhsn, irn, irndt, raw in qr_rows
+            if docno and mainhsn
+        }
+
+        # Fetch each distinct HSN once, however many invoices share it
+        unique_hsns = {hsn_lookup[row[0]] for row in summary_rows if row[0] in hsn_lookup}
+        gst_details = {hsn: self._fetch_gst_details(hsn) for hsn in unique_hsns if hsn in self.hsn_cache}
+
+        # Cache misses are independent HTTP calls, run them concurrently; the
+        # workers are named after this thread so their log records trace back to it
+        to_fetch = [hsn for hsn in unique_hsns if hsn not in gst_details]
+        if to_fetch:
+            with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(to_fetch)),
+                                    thread_name_prefix=threading.current_thread().name) as executor:
+                gst_details.update(zip(to_fetch, executor.map(self._fetch_gst_details, to_fetch)))
 
         # Process each invoice
-        for row in ws_summary.iter_rows(min_row=2, values_only=True):
+        for row in summary_rows:
             docno, docdt, *_ = row
             if not docno:
                 continue
 
             hsn = hsn_lookup.get(docno)
             if not hsn:
-                print(f"⚠ No HSN found for {docno}, skipping.")
+                logger.debug("No HSN found for %s, skipping.", docno)
+                missing_hsn += 1
                 continue
 
-            gst_rate, description, source = self._fetch_gst_details(hsn)
+            gst_rate, description, source = gst_details[hsn]
 
             if gst_rate:
                 cgst_rate = gst_rate / 2
@@ -137,15 +191,20 @@ class GSTFetcherAgent:
 
             desc_display = (description[:80] + "...") if description and len(description) > 80 else description
 
-            ws_gst.append([docno, docdt, hsn, desc_display, gst_rate, cgst_rate, sgst_rate, source])
-            print(f"✅ GST for {docno}: {gst_rate}% (HSN {hsn} - {desc_display}, Source: {source})")
+            gst_rows.append((docno, docdt, hsn, desc_display, gst_rate, cgst_rate, sgst_rate, source))
+            logger.debug("GST for %s: %s%% (HSN %s - %s, Source: %s)", docno, gst_rate, hsn, desc_display, source)
 
-        wb.save(self.excel_file)
-        wb.close()
+        self.workbook.update({"GST_Fetch": (GST_FETCH_HEADER, gst_rows)})
         self._save_hsn_cache()
-        print(f"📁 GST data saved in 'GST_Fetch' sheet of {self.excel_file}'")
+        logger.info("✅ GST fetched for %d invoices (%d without HSN)", len(gst_rows), missing_hsn)
+        logger.info("📁 GST data saved in 'GST_Fetch' sheet of %s", self.workbook.location())
+
+
+def run(state=None):
+    """Pipeline stage entry point (see pipeline.py)."""
+    GSTFetcherAgent(workbook=state.workbook if state else None).process()
 
 
 if __name__ == "__main__":
-    agent = GSTFetcherAgent()
-    agent.process()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    run()
@@ -1,14 +1,56 @@
 import fitz  # PyMuPDF
-from pyzbar.pyzbar import decode
+from pyzbar.pyzbar import decode, ZBarSymbol
 from PIL import Image
 import io
 import logging
+import logging.handlers
+import multiprocessing
 import base64
-import json
+import orjson
 import os
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Set
+
+logger = logging.getLogger(__name__)
+
+# Page render zoom for QR scanning (2x ≈ 144 dpi, enough for IRN QR codes)
+QR_RENDER_MATRIX = fitz.Matrix(2, 2)
+
+# Embedded images outside this pixel range (logos, signatures, full-page scans)
+# or in codecs zbar can't read directly are not decoded in the fallback scan
+QR_IMAGE_MIN_SIDE = 80
+QR_IMAGE_MAX_SIDE = 2000
+QR_SKIP_FILTERS = {"JBIG2Decode", "JPXDecode"}
+
+
+@lru_cache(maxsize=1024)
+def _decode_qr_jwt(qr_string: str) -> Dict[str, Any]:
+    """
+    Decode a JWT-like QR string (Base64 payload → JSON).
+    Memoized, since a multi-page invoice repeats the same QR on each page;
+    callers share the returned dict and must not mutate it.
+    """
+    try:
+        parts = qr_string.split(".")
+        if len(parts) != 3:
+            return {"error": "Not a valid JWT format"}
+
+        # Over-padding is ignored by the decoder, so no length arithmetic needed
+        decoded_bytes = base64.urlsafe_b64decode(parts[1] + "==")
+        decoded_json = orjson.loads(decoded_bytes)
+
+        # If "data" is a JSON string, parse it into dict
+        if isinstance(decoded_json.get("data"), str):
+            try:
+                decoded_json["data"] = orjson.loads(decoded_json["data"])
+            except orjson.JSONDecodeError:
+                pass  # keep as string if parsing fails
 
-logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+        return decoded_json
+    except Exception as e:
+        return {"error": str(e)}
 
 
 class PDFIngestionAgent:
@@ -24,7 +66,7 @@ class PDFIngestionAgent:
         try:
             doc = fitz.open(self.pdf_path)
         except Exception as e:
-            logging.error(f"Could not open PDF file at '{self.pdf_path}'. Reason: {e}")
+            logger.error(f"Could not open PDF file at '{self.pdf_path}'. Reason: {e}")
             return all_pages_content
 
         for page_num in range(len(doc)):
@@ -34,9 +76,8 @@ class PDFIngestionAgent:
             page_text = page.get_text("text") or ""
 
             # Extract QR codes (raw + decoded)
-            raw_qrs = self._extract_qr_from_images(doc, page, page_num)
-            unique_qrs = list(set(raw_qrs))  # deduplicate
-            decoded_qrs = [self._decode_qr_jwt(qr) for qr in unique_qrs]
+            unique_qrs = list(self._extract_qr_codes(doc, page, page_num))
+            decoded_qrs = [_decode_qr_jwt(qr) for qr in unique_qrs]
 
             page_content = {
                 "page_number": page_num + 1,
@@ -49,98 +90,157 @@ class PDFIngestionAgent:
         doc.close()
         return all_pages_content
 
-    def _extract_qr_from_images(self, doc, page, page_num: int) -> List[str]:
+    def _extract_qr_codes(self, doc, page, page_num: int) -> Set[str]:
+        """
+        Extract the distinct raw QR code strings from a page.
+        The rendered page is scanned first (also catches vector-drawn QR codes);
+        embedded images are only decoded one by one if that finds nothing.
+        """
+        decoded_qr_codes = self._extract_qr_from_render(page, page_num)
+        if decoded_qr_codes:
+            return decoded_qr_codes
+        return self._extract_qr_from_images(doc, page, page_num)
+
+    def _extract_qr_from_render(self, page, page_num: int) -> Set[str]:
+        """Rasterize the page once (grayscale) and scan it for QR codes."""
+        try:
+            pix = page.get_pixmap(matrix=QR_RENDER_MATRIX, colorspace=fitz.csGRAY, alpha=False)
+            image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+            decoded_objects = decode(image, symbols=[ZBarSymbol.QRCODE])
+            return {obj.data.decode("utf-8") for obj in decoded_objects}
+        except Exception as e:
+            logger.warning(f"Could not scan rendered page {page_num + 1}. Error: {e}")
+            return set()
+
+    def _extract_qr_from_images(self, doc, page, page_num: int) -> Set[str]:
         """Extract raw QR code strings from images in a page."""
-        decoded_qr_codes = []
+        decoded_qr_codes = set()
         image_list = page.get_images(full=True)
 
         for img_index, img in enumerate(image_list):
-            xref = img[0]
+            # (xref, smask, width, height, bpc, colorspace, alt. colorspace, name, filter, ...)
+            xref, width, height, img_filter = img[0], img[2], img[3], img[8]
+            if not (QR_IMAGE_MIN_SIDE <= width <= QR_IMAGE_MAX_SIDE and
+                    QR_IMAGE_MIN_SIDE <= height <= QR_IMAGE_MAX_SIDE):
+                continue
+            if img_filter in QR_SKIP_FILTERS:
+                continue
             try:
                 base_image = doc.extract_image(xref)
                 image_bytes = base_image["image"]
                 image = Image.open(io.BytesIO(image_bytes))
-                decoded_objects = decode(image)
+                decoded_objects = decode(image, symbols=[ZBarSymbol.QRCODE])
 
                 for obj in decoded_objects:
                     qr_data = obj.data.decode("utf-8")
-                    decoded_qr_codes.append(qr_data)
+                    decoded_qr_codes.add(qr_data)
             except Exception as e:
-                logging.warning(
+                logger.warning(
                     f"Could not process image {img_index + 1} on page {page_num + 1}. Error: {e}"
                 )
+            # An invoice page carries a single IRN QR, stop at the first one found
+            if decoded_qr_codes:
+                break
         return decoded_qr_codes
 
-    def _decode_qr_jwt(self, qr_string: str) -> Dict[str, Any]:
-        """Decode a JWT-like QR string (Base64 payload → JSON)."""
-        try:
-            parts = qr_string.split(".")
-            if len(parts) != 3:
-                return {"error": "Not a valid JWT format"}
-
-            payload = parts[1] + "=" * (-len(parts[1]) % 4)  # pad base64
-            decoded_bytes = base64.urlsafe_b64decode(payload)
-            decoded_json = json.loads(decoded_bytes.decode("utf-8"))
-
-            # If "data" is a JSON string, parse it into dict
-            if isinstance(decoded_json.get("data"), str):
-                try:
-                    decoded_json["data"] = json.loads(decoded_json["data"])
-                except json.JSONDecodeError:
-                    pass  # keep as string if parsing fails
-
-            return decoded_json
-        except Exception as e:
-            return {"error": str(e)}
 
+class _WorkerLogRelay(logging.Handler):
+    """Re-issue log records of the worker processes here, as if logged by the thread that started them."""
 
-if __name__ == "__main__":
+    def __init__(self):
+        super().__init__()
+        self.thread_name = threading.current_thread().name
+
+    def emit(self, record):
+        record.threadName = self.thread_name
+        logging.getLogger(record.name).handle(record)
+
+
+def _init_worker(log_queue) -> None:
+    """Worker initializer: send all log records to the parent process instead of printing them."""
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+
+
+def _process_one(pdf_path: str):
+    """Worker entry point: extract one PDF (runs in a separate process)."""
+    logger.info(f"📄 Processing invoice: {pdf_path}")
+    agent = PDFIngestionAgent(pdf_path)
+    return os.path.basename(pdf_path), agent.extract_pdf_content()
+
+
+def _format_pdf_content(file_name: str, pdf_content: List[Dict]) -> str:
+    """Render one PDF's extracted pages as a single block of report text."""
+    rule = "#" * 40
+    parts = [
+        f"\n=== Extracted from {file_name} ===\n",
+        "--- Successfully Extracted PDF Content ---\n",
+    ]
+    for page_data in pdf_content:
+        parts.append(f"\n{rule}\n# Page {page_data['page_number']}\n{rule}\n")
+
+        if page_data['qr_codes_raw']:
+            parts.append("\n[--- QR Code(s) Found ---]\n")
+            for i, qr_data in enumerate(page_data['qr_codes_raw']):
+                parts.append(f"  QR Code {i + 1}: {qr_data}\n")
+            parts.append("[--------------------------]\n\n")
+
+            parts.append("[--- Decoded QR Payload(s) ---]\n")
+            for decoded in page_data['qr_codes_decoded']:
+                parts.append(orjson.dumps(decoded, option=orjson.OPT_INDENT_2).decode() + "\n")
+            parts.append("[-----------------------------]\n\n")
+        else:
+            parts.append("\n[--- No QR Codes Found ---]\n\n")
+
+        parts.append("[--- Text Content ---]\n")
+        parts.append(page_data['text'] + "\n")
+        parts.append("[--------------------]\n")
+    return "".join(parts)
+
+
+def run(state=None):
+    """Pipeline stage entry point (see pipeline.py): extract every PDF in the invoices folder."""
     invoices_dir = "data/invoices"
     output_file_path = "data/outputs/extracted_content.txt"
 
     # Ensure outputs folder exists
     os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
 
-    # Start fresh (overwrite old file)
-    with open(output_file_path, "w", encoding="utf-8") as f:
-        f.write("")
-
-    # Walk through invoices folder & process all PDFs
-    for root, _, files in os.walk(invoices_dir):
-        for file_name in files:
-            if file_name.lower().endswith(".pdf"):
-                pdf_path = os.path.join(root, file_name)
-                logging.info(f"📄 Processing invoice: {pdf_path}")
-
-                agent = PDFIngestionAgent(pdf_path)
-                pdf_content = agent.extract_pdf_content()
-
+    # Walk through invoices folder & collect all PDFs
+    pdf_paths = [
+        os.path.join(root, file_name)
+        for root, _, files in os.walk(invoices_dir)
+        for file_name in files
+        if file_name.lower().endswith(".pdf")
+    ]
+
+    # PDFs are independent and CPU-bound (PyMuPDF + zbar), so extract them in
+    # parallel; results come back in order and are written by this process only.
+    # The output file is opened once (fresh, 1 MiB buffer) for the whole run.
+    # Worker log records travel back over a queue and are logged from here.
+    # Small batches get one worker per PDF and no more; large ones are handed
+    # out a few chunks per worker, so the load stays even across the pool.
+    workers = min(os.cpu_count() or 1, len(pdf_paths)) or 1
+    chunksize = max(1, len(pdf_paths) // (workers * 4))
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, _WorkerLogRelay())
+    listener.start()
+    try:
+        with open(output_file_path, "w", encoding="utf-8", buffering=1 << 20) as f, \
+                ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                    initargs=(log_queue,)) as executor:
+            for file_name, pdf_content in executor.map(_process_one, pdf_paths, chunksize=chunksize):
                 if pdf_content:
-                    with open(output_file_path, "a", encoding="utf-8") as f:
-                        f.write(f"\n=== Extracted from {file_name} ===\n")
-                        f.write("--- Successfully Extracted PDF Content ---\n")
-                        for page_data in pdf_content:
-                            f.write(
-                                "\n" + "#"*40 + f"\n# Page {page_data['page_number']}\n" + "#"*40 + "\n"
-                            )
-
-                            if page_data['qr_codes_raw']:
-                                f.write("\n[--- QR Code(s) Found ---]\n")
-                                for i, qr_data in enumerate(page_data['qr_codes_raw']):
-                                    f.write(f"  QR Code {i + 1}: {qr_data}\n")
-                                f.write("[--------------------------]\n\n")
-
-                                f.write("[--- Decoded QR Payload(s) ---]\n")
-                                for decoded in page_data['qr_codes_decoded']:
-                                    f.write(json.dumps(decoded, indent=4) + "\n")
-                                f.write("[-----------------------------]\n\n")
-                            else:
-                                f.write("\n[--- No QR Codes Found ---]\n\n")
-
-                            f.write("[--- Text Content ---]\n")
-                            f.write(page_data['text'] + "\n")
-                            f.write("[--------------------]\n")
+                    f.write(_format_pdf_content(file_name, pdf_content))
                 else:
-                    logging.warning(f"No content extracted from {pdf_path}")
+                    logger.warning(f"No content extracted from {file_name}")
+    finally:
+        listener.stop()  # after the workers are gone, so every record is through
 
-    logging.info(f"✅ Extraction complete. Results saved in '{output_file_path}'")
+    logger.info(f"✅ Extraction complete. Results saved in '{output_file_path}'")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    run()
@@ -1,18 +1,88 @@
 # agents/logger_agent.py
 
+import logging
 import os
 import re
-import json
-import openpyxl
-from openpyxl import Workbook, load_workbook
+import orjson
+
+try:
+    import re2 as fast_re  # google-re2: linear-time matching, no backtracking blow-ups
+except ImportError:
+    fast_re = re
+
+try:
+    from agents.excel_io import WorkbookFile
+except ImportError:  # run as a script from agents/
+    from excel_io import WorkbookFile
+
+logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.join("data", "outputs")
 EXCEL_FILE = os.path.join(BASE_DIR, "invoices_data.xlsx")
 EXTRACTED_FILE = os.path.join(BASE_DIR, "extracted_content.txt")
 
+SUMMARY_HEADER = (
+    "DocNo", "DocDt", "SellerGstin", "BuyerGstin", "IRN", "AckNo",
+    "EWayBill", "PlaceOfSupply", "Transport", "VehicleNo",
+    "ItemCnt(QR)", "TotInvVal(QR)", "TaxableAmount",
+    "CGST_Amount", "SGST_Amount", "TotalTax", "VendorName", "ValidationFlag"
+)
+LINE_ITEMS_HEADER = (
+    "DocNo", "S.No", "Description", "HSN/SAC", "Quantity", "Unit",
+    "Rate", "Amount"
+)
+QR_META_HEADER = (
+    "DocNo", "SellerGstin", "BuyerGstin", "DocTyp", "DocDt",
+    "TotInvVal", "ItemCnt", "MainHsnCode", "IRN", "IrnDt", "RawPayload"
+)
+# Record keys behind each Invoice_Summary column (line item / QR keys match their headers)
+SUMMARY_KEYS = (
+    "DocNo", "DocDt", "SellerGstin", "BuyerGstin", "IRN", "AckNo",
+    "EWayBill", "PlaceOfSupply", "Transport", "VehicleNo",
+    "ItemCnt", "TotInvVal", "TaxableAmount",
+    "CGST_Amount", "SGST_Amount", "TotalTax", "VendorName", "ValidationFlag"
+)
+
+# --- Precompiled patterns used while parsing invoice blocks ---
+# Patterns scanning whole blocks use fast_re (RE2 when installed); DOTALL is
+# set inline with (?s) since RE2 takes no `re` flags
+_RE_QR = fast_re.compile(r"(?s)\[--- Decoded QR Payload\(s\) ---\]\s*(\{.*?\})\s*\[")
+# All header fields in one pass; each alternative's group is named after its summary key.
+# The alternatives are lookaheads, so a match consumes nothing and a field that
+# follows another on the same line (after Place of Supply's value) is still found.
+# Place of Supply's value stays on the line of its colon, a blank one is None.
+_RE_HEADER = re.compile(
+    r"(?=Ack\.No\.\s*:\s*(?P<AckNo>\d+))"
+    r"|(?=E-Way Bill No\.\s*:\s*(?P<EWayBill>\S+))"
+    r"|(?=Place of Supply\s*:[^\S\n]*(?P<PlaceOfSupply>.*))"
+    r"|(?=Vehicle No\.\s*:\s*(?P<VehicleNo>\S+))"
+    r"|(?=Transport\s*:\s*(?P<Transport>\S+))"
+    r"|(?=(?P<ValidationFlag>VALIDATION:.*))"
+)
+HEADER_FIELDS = tuple(_RE_HEADER.groupindex)
+# Vendor name = first non-empty line after the "TAX INVOICE" title line
+_RE_VENDOR = re.compile(r"TAX INVOICE.*\n\s*(\S.*)", re.I)
+_RE_TAX = fast_re.compile(
+    r"(\d{8})\s+\d+%?\s+([\d,]+\.\d{2})\s+([\d,]+\.\d{2})\s+([\d,]+\.\d{2})(?:\s+([\d,]+\.\d{2}))?"
+)
+_RE_ITEMS_BLOCK = fast_re.compile(
+    r"(?s)S\.N.*?Amount\(`\s*\)\s*\n(.*?)(?:Add\s*: CGST|HSN/SAC\s+Tax Rate|VALIDATION:)"
+)
+_RE_QTY_UNIT = re.compile(r"[\d,\.]+\s+(SET|Pcs\.|KG|Units?)")
+_RE_QTY = re.compile(r"([\d,\.]+)\s+(\S+)")
+_RE_HSN = re.compile(r"\d{8}")
+_RE_SNO = re.compile(r"^\d+\.")
+
+
+def _to_rows(records, keys):
+    """Project parsed record dicts onto sheet rows in column order."""
+    return [tuple(record.get(key) for key in keys) for record in records]
+
+
 class LoggerAgent:
-    def __init__(self, excel_file=EXCEL_FILE, txt_file=EXTRACTED_FILE):
-        self.excel_file = excel_file
+    def __init__(self, excel_file=EXCEL_FILE, txt_file=EXTRACTED_FILE, workbook=None):
+        self.workbook = workbook or WorkbookFile(excel_file)
+        self.excel_file = self.workbook.path
         self.txt_file = txt_file
         if not os.path.exists(BASE_DIR):
             os.makedirs(BASE_DIR)
@@ -20,55 +90,32 @@ class LoggerAgent:
 
     def _init_excel(self):
         """Create Excel file with required sheets if it doesn’t exist"""
-        if not os.path.exists(self.excel_file):
-            wb = Workbook()
-
-            # Invoice Summary
-            ws1 = wb.active
-            ws1.title = "Invoice_Summary"
-            ws1.append([
-                "DocNo", "DocDt", "SellerGstin", "BuyerGstin", "IRN", "AckNo",
-                "EWayBill", "PlaceOfSupply", "Transport", "VehicleNo",
-                "ItemCnt(QR)", "TotInvVal(QR)", "TaxableAmount",
-                "CGST_Amount", "SGST_Amount", "TotalTax", "VendorName", "ValidationFlag"
-            ])
-
-            # Line Items
-            ws2 = wb.create_sheet("Line_Items")
-            ws2.append([
-                "DocNo", "S.No", "Description", "HSN/SAC", "Quantity", "Unit",
-                "Rate", "Amount"
-            ])
-
-            # QR Meta
-            ws3 = wb.create_sheet("QR_Meta")
-            ws3.append([
-                "DocNo", "SellerGstin", "BuyerGstin", "DocTyp", "DocDt",
-                "TotInvVal", "ItemCnt", "MainHsnCode", "IRN", "IrnDt", "RawPayload"
-            ])
-
-            wb.save(self.excel_file)
-
-    def _split_invoices(self, text: str):
-        """Split text into invoice blocks using 'VALIDATION:' marker"""
-        blocks = []
+        if not self.workbook.exists():
+            self.workbook.write({
+                "Invoice_Summary": (SUMMARY_HEADER, []),
+                "Line_Items": (LINE_ITEMS_HEADER, []),
+                "QR_Meta": (QR_META_HEADER, []),
+            })
+
+    def _iter_invoices(self, path: str):
+        """Stream invoice blocks from a file, one per 'VALIDATION:' marker"""
         current = []
-        for line in text.splitlines():
-            current.append(line)
-            if line.strip().startswith("VALIDATION:"):
-                blocks.append("\n".join(current))
-                current = []
-        return blocks
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                current.append(line)
+                if line.lstrip().startswith("VALIDATION:"):
+                    yield "".join(current)
+                    current = []
 
     def _parse_invoice(self, block: str):
         """Parse one invoice block into summary, line items, QR meta"""
         summary, line_items, qr_meta = {}, [], {}
 
         # --- QR Payload ---
-        qr_match = re.search(r"\[--- Decoded QR Payload\(s\) ---\]\s*(\{.*?\})\s*\[", block, re.S)
+        qr_match = _RE_QR.search(block)
         if qr_match:
             try:
-                data = json.loads(qr_match.group(1)).get("data", {})
+                data = orjson.loads(qr_match.group(1)).get("data", {})
                 qr_meta = {
                     "DocNo": data.get("DocNo"),
                     "SellerGstin": data.get("SellerGstin"),
@@ -80,53 +127,37 @@ class LoggerAgent:
                     "MainHsnCode": data.get("MainHsnCode"),
                     "IRN": data.get("Irn"),
                     "IrnDt": data.get("IrnDt"),
-                    "RawPayload": json.dumps(data)
+                    "RawPayload": orjson.dumps(data).decode()
                 }
                 summary.update(qr_meta)
             except Exception as e:
-                print(f"⚠️ QR parse error: {e}")
+                logger.warning("⚠️ QR parse error: %s", e)
 
         # --- Extract Header Fields ---
-        def safe_search(pattern, text, group=1):
-            m = re.search(pattern, text, re.S)
-            return m.group(group).strip() if m else None
-
         def clean_num(val):
             if not val:
                 return None
             return float(val.replace(",", ""))
 
-        summary.update({
-            "AckNo": safe_search(r"Ack\.No\.\s*:\s*(\d+)", block),
-            "EWayBill": safe_search(r"E-Way Bill No\.\s*:\s*(\S+)", block),
-            "PlaceOfSupply": safe_search(r"Place of Supply\s*:\s*(.*)", block),
-            "VehicleNo": safe_search(r"Vehicle No\.\s*:\s*(\S+)", block),
-            "Transport": safe_search(r"Transport\s*:\s*(\S+)", block),
-            "ValidationFlag": safe_search(r"(VALIDATION:.*)", block),
-        })
-
-        # --- Extract Vendor Name ---
-        vendor_name = None
-        try:
-            lines = block.splitlines()
-            for i, line in enumerate(lines):
-                if "TAX INVOICE" in line.upper():
-                    for j in range(i+1, len(lines)):
-                        candidate = lines[j].strip()
-                        if candidate:
-                            vendor_name = candidate
-                            break
+        # First occurrence of each header field wins
+        header = dict.fromkeys(HEADER_FIELDS)
+        missing = len(header)
+        for m in _RE_HEADER.finditer(block):
+            field = m.lastgroup
+            value = m.group(field).strip()
+            if value and header[field] is None:
+                header[field] = value
+                missing -= 1
+                if not missing:
                     break
-        except Exception as e:
-            print(f"⚠️ Vendor name parse error: {e}")
+        summary.update(header)
 
-        summary["VendorName"] = vendor_name
+        # --- Extract Vendor Name ---
+        vendor_match = _RE_VENDOR.search(block)
+        summary["VendorName"] = vendor_match.group(1).strip() if vendor_match else None
 
         # --- Extract Taxes ---
-        tax_match = re.search(
-            r"(\d{8})\s+\d+%?\s+([\d,]+\.\d{2})\s+([\d,]+\.\d{2})\s+([\d,]+\.\d{2})(?:\s+([\d,]+\.\d{2}))?",
-            block
-        )
+        tax_match = _RE_TAX.search(block)
         if tax_match:
             summary["TaxableAmount"] = clean_num(tax_match.group(2))
             summary["CGST_Amount"] = clean_num(tax_match.group(3))
@@ -136,12 +167,12 @@ class LoggerAgent:
             )
 
         # --- Robust Multi-line Line Item Parser ---
-        items_block = re.search(r"S\.N.*?Amount\(`\s*\)\s*\n(.*?)(?:Add\s*: CGST|HSN/SAC\s+Tax Rate|VALIDATION:)", block, re.S)
+        items_block = _RE_ITEMS_BLOCK.search(block)
         if items_block:
             lines = [l.strip() for l in items_block.group(1).splitlines() if l.strip()]
             for i in range(len(lines)):
                 # Look for qty/unit line
-                if re.match(r"[\d,\.]+\s+(SET|Pcs\.|KG|Units?)", lines[i]):
+                if _RE_QTY_UNIT.match(lines[i]):
                     try:
                         qty_line = lines[i]
                         hsn_line = lines[i - 1]
@@ -149,14 +180,14 @@ class LoggerAgent:
                         rate_line = lines[i + 1]
                         amt_line = lines[i + 2]
 
-                        if not re.fullmatch(r"\d{8}", hsn_line):
+                        if not _RE_HSN.fullmatch(hsn_line):
                             continue
 
                         s_no = None
-                        if re.match(r"^\d+\.", lines[i - 3]):
+                        if _RE_SNO.match(lines[i - 3]):
                             s_no = int(lines[i - 3].split(".")[0])
 
-                        qty, unit = re.match(r"([\d,\.]+)\s+(\S+)", qty_line).groups()
+                        qty, unit = _RE_QTY.match(qty_line).groups()
                         line_items.append({
                             "S.No": s_no,
                             "Description": desc_line,
@@ -174,23 +205,21 @@ class LoggerAgent:
     def process(self):
         """Main entry: parse extracted_content.txt and log to Excel"""
         if not os.path.exists(self.txt_file):
-            print(f"❌ File not found: {self.txt_file}")
+            logger.error("❌ File not found: %s", self.txt_file)
             return
 
-        with open(self.txt_file, "r", encoding="utf-8") as f:
-            text = f.read()
-
-        blocks = self._split_invoices(text)
-        print(f"Found {len(blocks)} invoices.")
-
-        wb = load_workbook(self.excel_file)
-        ws_summary = wb["Invoice_Summary"]
-        ws_items = wb["Line_Items"]
-        ws_qr = wb["QR_Meta"]
-
-        existing_keys = {f"{row[2]}_{row[0]}" for row in ws_summary.iter_rows(min_row=2, values_only=True)}
-
-        for block in blocks:
+        # Read existing rows once, then rebuild all three sheets in a single write
+        sheets = {
+            name: self.workbook.read(name)
+            for name in ("Invoice_Summary", "Line_Items", "QR_Meta")
+        }
+        existing_keys = {f"{row[2]}_{row[0]}" for row in sheets["Invoice_Summary"][1]}
+
+        # Parse everything into plain records first, no Excel work inside the loop
+        summaries, line_items, qr_metas = [], [], []
+        found = duplicates = 0
+        for block in self._iter_invoices(self.txt_file):
+            found += 1
             summary, items, qr_meta = self._parse_invoice(block)
 
             if not summary.get("DocNo") or not summary.get("SellerGstin"):
@@ -198,43 +227,37 @@ class LoggerAgent:
 
             comp_key = f"{summary.get('SellerGstin')}_{summary.get('DocNo')}"
             if comp_key in existing_keys:
-                print(f"⚠️ Skipping duplicate {comp_key}")
+                logger.debug("Skipping duplicate %s", comp_key)
+                duplicates += 1
                 continue
 
-            ws_summary.append([
-                summary.get("DocNo"), summary.get("DocDt"), summary.get("SellerGstin"),
-                summary.get("BuyerGstin"), summary.get("IRN"), summary.get("AckNo"),
-                summary.get("EWayBill"), summary.get("PlaceOfSupply"), summary.get("Transport"),
-                summary.get("VehicleNo"), summary.get("ItemCnt"), summary.get("TotInvVal"),
-                summary.get("TaxableAmount"), summary.get("CGST_Amount"),
-                summary.get("SGST_Amount"), summary.get("TotalTax"),
-                summary.get("VendorName"),  # <-- added here
-                summary.get("ValidationFlag")
-            ])
-
-            for item in items:
-                ws_items.append([
-                    summary.get("DocNo"), item.get("S.No"), item.get("Description"),
-                    item.get("HSN/SAC"), item.get("Quantity"), item.get("Unit"),
-                    item.get("Rate"), item.get("Amount")
-                ])
-
+            summaries.append(summary)
+            line_items.extend({"DocNo": summary.get("DocNo"), **item} for item in items)
             if qr_meta:
-                ws_qr.append([
-                    qr_meta.get("DocNo"), qr_meta.get("SellerGstin"), qr_meta.get("BuyerGstin"),
-                    qr_meta.get("DocTyp"), qr_meta.get("DocDt"), qr_meta.get("TotInvVal"),
-                    qr_meta.get("ItemCnt"), qr_meta.get("MainHsnCode"), qr_meta.get("IRN"),
-                    qr_meta.get("IrnDt"), qr_meta.get("RawPayload")
-                ])
-
-            print(f"✅ Logged invoice {summary.get('DocNo')} with {len(items)} items")
+                qr_metas.append(qr_meta)
+
+            logger.debug("Logged invoice %s with %d items", summary.get("DocNo"), len(items))
             existing_keys.add(comp_key)
 
-        wb.save(self.excel_file)
-        wb.close()
-        print(f"📁 Data saved to {self.excel_file}")
+        new_rows = {
+            "Invoice_Summary": _to_rows(summaries, SUMMARY_KEYS),
+            "Line_Items": _to_rows(line_items, LINE_ITEMS_HEADER),
+            "QR_Meta": _to_rows(qr_metas, QR_META_HEADER),
+        }
+        self.workbook.update({
+            name: (header, rows + new_rows[name])
+            for name, (header, rows) in sheets.items()
+        }, xml_sheets=("Line_Items",))
+        logger.info("Found %d invoices.", found)
+        logger.info("✅ Logged %d invoices (%d duplicates skipped)", len(summaries), duplicates)
+        logger.info("📁 Data saved to %s", self.workbook.location())
+
+
+def run(state=None):
+    """Pipeline stage entry point (see pipeline.py)."""
+    LoggerAgent(workbook=state.workbook if state else None).process()
 
 
 if __name__ == "__main__":
-    agent = LoggerAgent()
-    agent.process()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    run()
@@ -1,112 +1,116 @@
 # agents/mapper_agent.py
 
+import logging
 import os
 import re
-import openpyxl
-from openpyxl import load_workbook
+from functools import lru_cache
+try:
+    from agents.excel_io import WorkbookFile, read_sheet
+except ImportError:  # run as a script from agents/
+    from excel_io import WorkbookFile, read_sheet
+
+logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.join("data", "outputs")
 INVOICE_FILE = os.path.join(BASE_DIR, "invoices_data.xlsx")
 MASTER_FILE = os.path.join(BASE_DIR, "master_file.xlsx")
 
+MAPPED_HEADER = (
+    "DocNo", "S.No", "Description", "HSN (Invoice)", "Quantity", "Unit",
+    "Rate (Invoice)", "Amount", "Mapped Model", "Mapped Product Name",
+    "Mapped SKU", "Mapped HSN", "Standard Rate", "Rate Match Flag"
+)
+UNMAPPED_HEADER = (
+    "DocNo", "S.No", "Description", "HSN (Invoice)", "Quantity", "Unit",
+    "Rate (Invoice)", "Amount", "Normalized Model"
+)
+
+ROW_PAD = (None,) * 8
+
+# "MODEL NO" prefix and HSN in brackets e.g. (73239920), removed in one pass
+_RE_CLEAN = re.compile(r"\(\d+\)|MODEL NO", re.I)
+_RE_WS = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=8192)
+def _normalize_model(text: str) -> str:
+    """Normalize model no strings for matching"""
+    if not text:
+        return ""
+    # collapse multiple spaces
+    return _RE_WS.sub(" ", _RE_CLEAN.sub("", text)).strip().upper()
+
+
 class MapperAgent:
-    def __init__(self, invoice_file=INVOICE_FILE, master_file=MASTER_FILE):
-        self.invoice_file = invoice_file
+    def __init__(self, invoice_file=INVOICE_FILE, master_file=MASTER_FILE, workbook=None):
+        self.workbook = workbook or WorkbookFile(invoice_file)
+        self.invoice_file = self.workbook.path
         self.master_file = master_file
 
-    def _normalize_model(self, text: str) -> str:
-        """Normalize model no strings for matching"""
-        if not text:
-            return ""
-        text = text.upper()
-        text = text.replace("MODEL NO", "").strip()
-        # remove HSN in brackets e.g. (73239920)
-        text = re.sub(r"\(\d+\)", "", text)
-        # collapse multiple spaces
-        text = re.sub(r"\s+", " ", text).strip()
-        return text
-
     def process(self):
         # --- Load Master File ---
         if not os.path.exists(self.master_file):
-            print(f"❌ Master file not found: {self.master_file}")
+            logger.error("❌ Master file not found: %s", self.master_file)
             return
 
-        master_wb = load_workbook(self.master_file)
-        master_ws = master_wb.active
+        _, master_rows = read_sheet(self.master_file)
 
-        master_map = {}
-        for row in master_ws.iter_rows(min_row=2, values_only=True):
-            model_no, prod_name, sku, hsn, rate = row
-            norm_model = self._normalize_model(str(model_no))
-            master_map[norm_model] = {
+        master_map = {
+            _normalize_model(str(model_no)): {
                 "ProductName": prod_name,
                 "SKU": sku,
                 "HSN": hsn,
                 "Rate": rate
             }
+            for model_no, prod_name, sku, hsn, rate in master_rows
+        }
 
         # --- Load Invoice File ---
-        if not os.path.exists(self.invoice_file):
-            print(f"❌ Invoice file not found: {self.invoice_file}")
+        if not self.workbook.exists():
+            logger.error("❌ Invoice file not found: %s", self.invoice_file)
             return
 
-        wb = load_workbook(self.invoice_file)
-        ws_items = wb["Line_Items"]
-
-        # Reset Mapped_Items and Unmapped_Items sheets if they exist
-        for sheet in ["Mapped_Items", "Unmapped_Items"]:
-            if sheet in wb.sheetnames:
-                del wb[sheet]
-
-        ws_map = wb.create_sheet("Mapped_Items")
-        ws_unmap = wb.create_sheet("Unmapped_Items")
-
-        # Headers for mapped
-        ws_map.append([
-            "DocNo", "S.No", "Description", "HSN (Invoice)", "Quantity", "Unit",
-            "Rate (Invoice)", "Amount", "Mapped Model", "Mapped Product Name",
-            "Mapped SKU", "Mapped HSN", "Standard Rate", "Rate Match Flag"
-        ])
-        # Headers for unmapped
-        ws_unmap.append([
-            "DocNo", "S.No", "Description", "HSN (Invoice)", "Quantity", "Unit",
-            "Rate (Invoice)", "Amount", "Normalized Model"
-        ])
+        _, item_rows = self.workbook.read("Line_Items")
+        mapped_rows, unmapped_rows = [], []
 
         # --- Process Line Items ---
-        for row in ws_items.iter_rows(min_row=2, values_only=True):
-            row = list(row[:8])   # Take only first 8 columns (ignore "Item Category")
-            if len(row) < 8:
-                row += [None] * (8 - len(row))  # pad missing with None
-
-            docno, sno, desc, hsn, qty, unit, rate, amount = row
+        for row in item_rows:
+            # Take only the first 8 columns (ignore "Item Category"), padding short rows
+            docno, sno, desc, hsn, qty, unit, rate, amount = (*row, *ROW_PAD)[:8]
 
-            norm_model = self._normalize_model(str(desc))
+            norm_model = _normalize_model(str(desc))
             mapped = master_map.get(norm_model, None)
 
             if mapped:
                 rate_match = "✅" if float(rate) == float(mapped["Rate"]) else "❌"
-                ws_map.append([
+                mapped_rows.append((
                     docno, sno, desc, hsn, qty, unit, rate, amount,
                     norm_model, mapped["ProductName"], mapped["SKU"],
                     mapped["HSN"], mapped["Rate"], rate_match
-                ])
+                ))
             else:
                 # Unmapped goes to both sheets
-                ws_map.append([
+                mapped_rows.append((
                     docno, sno, desc, hsn, qty, unit, rate, amount,
                     norm_model, "NOT FOUND", "NOT FOUND", "NOT FOUND", "NOT FOUND", "❌"
-                ])
-                ws_unmap.append([
+                ))
+                unmapped_rows.append((
                     docno, sno, desc, hsn, qty, unit, rate, amount, norm_model
-                ])
+                ))
+
+        self.workbook.update({
+            "Mapped_Items": (MAPPED_HEADER, mapped_rows),
+            "Unmapped_Items": (UNMAPPED_HEADER, unmapped_rows),
+        })
+        logger.info("📁 Mapping completed. Results saved in 'Mapped_Items' and 'Unmapped_Items' sheets of %s",
+                    self.workbook.location())
+
 
-        wb.save(self.invoice_file)
-        wb.close()
-        print(f"📁 Mapping completed. Results saved in 'Mapped_Items' and 'Unmapped_Items' sheets of {self.invoice_file}'")
+def run(state=None):
+    """Pipeline stage entry point (see pipeline.py)."""
+    MapperAgent(workbook=state.workbook if state else None).process()
 
 
 if __name__ == "__main__":
-    agent = MapperAgent()
-    agent.process()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    run()
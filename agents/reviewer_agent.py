@@ -1,202 +1,274 @@
 # agents/reviewer_agent.py
 
+import argparse
+import logging
 import os
-from openpyxl import load_workbook
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+try:
+    from agents.excel_io import WorkbookFile, write_workbook
+except ImportError:  # run as a script from agents/
+    from excel_io import WorkbookFile, write_workbook
+
+logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.join("data", "outputs")
 EXCEL_FILE = os.path.join(BASE_DIR, "invoices_data.xlsx")
+REVIEW_FILE = os.path.join(BASE_DIR, "invoices_review.xlsx")
+
+LINE_ITEM_COLUMNS = ("DocNo", "S.No", "Description", "HSN", "Quantity", "Unit", "Rate", "Amount")
+GST_FETCH_COLUMNS = ("DocNo", "DocDt", "HSN", "Description", "GST", "CGST", "SGST", "Source")
+REVIEW_HEADER = (
+    "DocNo", "Taxable (from Items)", "GST_Rate (%)",
+    "CGST_calc", "SGST_calc", "ExpectedTotal",
+    "QR_Total (TotInvVal)", "Diff", "InvoiceTotal_OK"
+)
+LINE_ITEM_ERRORS_HEADER = (
+    "DocNo", "S.No", "Description", "Quantity", "Rate",
+    "Stored Amount", "Computed Amount", "Match Flag"
+)
+ITEM_CATEGORIES_HEADER = ("DocNo", "Item Category")
+AMOUNT_TOLERANCE = 0.01  # absolute, in rupees, for line amounts and invoice totals
+SKIPPED_SHOWN = 10  # DocNos listed in the skipped-invoices line
+QUALITY_REPORT_HEADER = ("Check", "Value")
+REVIEW_SHEETS = ("Review_Report", "LineItem_Errors", "Item_Categories", "Quality_Report")
+# Report sheets that used to live in the invoices workbook
+LEGACY_REPORT_SHEETS = ("Review_Report", "LineItem_Errors")
+
+# TotInvVal header patterns, best first; item count columns never qualify
+_TOTINV_PATTERNS = (
+    re.compile(r"tot.?inv.?val", re.I),
+    re.compile(r"total.*invoice|invoice.*total", re.I),
+    re.compile(r"total.*(value|amount)", re.I),
+    re.compile(r"qr.*tot", re.I),
+)
+_RE_NOT_TOTAL = re.compile(r"item|count|cnt", re.I)
+
+
+@lru_cache(maxsize=32)
+def _find_totinv_column(header):
+    """Find TotInvVal / Invoice Total column index heuristically."""
+    best = None
+    for i, h in enumerate(header):
+        h = str(h).strip() if h else ""
+        if not h or _RE_NOT_TOTAL.search(h):
+            continue
+        for rank, pattern in enumerate(_TOTINV_PATTERNS):
+            if pattern.search(h):
+                if best is None or rank < best[0]:
+                    best = (rank, i)
+                break
+
+    if best is not None:
+        return best[1]
+    if len(header) >= 12:
+        return 11
+    return None
+
+
+def _docno_index(lookup):
+    """DocNo index over a lookup's keys (object dtype, so mixed DocNo types line up)."""
+    return pd.Index(list(lookup), dtype=object)
+
+
+def _by_docno(values):
+    """Float Series over a {DocNo: value} dict."""
+    return pd.Series(list(values.values()), index=_docno_index(values), dtype=float)
+
+
+def clean_currency(s):
+    """Numeric Series from money-like values ("2,360.00", "₹ 590", "INR 100"); NaN where unparseable."""
+    cleaned = s.astype("string").str.replace(r"[,₹]|INR|\s", "", regex=True)
+    return pd.to_numeric(cleaned, errors="coerce").astype(float)
+
+
+def _unparsed(raw, parsed):
+    """How many cells held a value that did not parse as a number."""
+    return int((raw.notna() & raw.ne("") & parsed.isna()).sum())
+
+
+def _frame_rows(df):
+    """Plain row lists from a DataFrame, with NaN turned back into empty cells."""
+    return df.astype(object).where(df.notna(), None).to_numpy().tolist()
 
 
 class ReviewerAgent:
-    def __init__(self, excel_file=EXCEL_FILE):
-        self.excel_file = excel_file
-
-    def _find_totinv_column(self, ws):
-        """Find TotInvVal / Invoice Total column index heuristically."""
-        header_cells = list(ws[1])
-        header = [cell.value for cell in header_cells]
-        header_norm = [str(h).strip().lower() if h else "" for h in header]
-
-        # Strong matches
-        for i, h in enumerate(header_norm):
-            if not h:
-                continue
-            if "item" in h or "count" in h or "cnt" in h:
-                continue
-            if ("totinv" in h) or ("tot inv" in h) or \
-               ("total" in h and ("inv" in h or "invoice")) or \
-               ("invoice" in h and "total" in h) or \
-               ("total" in h and "value" in h) or \
-               ("totalinvoice" in h) or ("totinvval" in h):
-                return i
-
-        # Looser matches
-        for i, h in enumerate(header_norm):
-            if not h or "item" in h:
-                continue
-            if "total" in h and ("value" in h or "amount" in h or "inv" in h or "invoice"):
-                return i
-            if "qr" in h and ("total" in h or "tot" in h):
-                return i
-
-        if len(header_norm) >= 12:
-            return 11
-
-        return None
-
-    def _to_float(self, val):
-        """Convert a value into float safely."""
-        if val is None:
-            return None
-        if isinstance(val, (int, float)):
-            return float(val)
-        s = str(val).strip().replace(",", "").replace("₹", "").replace("INR", "")
-        if not s:
-            return None
-        try:
-            return float(s)
-        except Exception:
-            try:
-                return float(s.split()[0])
-            except Exception:
-                return None
+    def __init__(self, excel_file=EXCEL_FILE, review_file=REVIEW_FILE, workbook=None, fast_writer=False):
+        self.workbook = workbook or WorkbookFile(excel_file)
+        self.excel_file = self.workbook.path
+        self.review_file = review_file
+        # Write the report sheets as hand-made sheet XML instead of through openpyxl
+        self.fast_writer = fast_writer
+
+    def _drop_stale_reports(self):
+        """
+        Older runs wrote the reports into the invoices workbook itself (plus an
+        "Item Category" column on Line_Items); remove those leftovers once so
+        nobody reads outdated results from there.
+        """
+        stale = [name for name in LEGACY_REPORT_SHEETS if name in self.workbook.sheet_names()]
+        sheets = {}
+        item_header, item_rows = self.workbook.stream("Line_Items")
+        if "Item Category" in item_header:
+            idx = item_header.index("Item Category")
+            sheets["Line_Items"] = (
+                (*item_header[:idx], *item_header[idx + 1:]),
+                [(*row[:idx], *row[idx + 1:]) for row in item_rows],
+            )
+        if stale or sheets:
+            self.workbook.update(sheets, xml_sheets=("Line_Items",), drop=stale)
+            logger.info("🧹 Removed old review results from %s (now in '%s').", self.workbook.location(), self.review_file)
 
     def process(self):
-        if not os.path.exists(self.excel_file):
-            print(f"❌ Invoice file not found: {self.excel_file}")
+        if not self.workbook.exists():
+            logger.error("❌ Invoice file not found: %s", self.excel_file)
             return
 
-        wb = load_workbook(self.excel_file)
+        self._drop_stale_reports()
 
-        ws_items = wb["Line_Items"]
-        ws_summary = wb["Invoice_Summary"]
-        ws_gst = wb["GST_Fetch"]
+        # Each input sheet is streamed straight into its frame, one sheet at a
+        # time, so no full copy of the rows is held next to the DataFrame
 
-        # Reset review sheets if they exist
-        for sheet in ["Review_Report", "LineItem_Errors"]:
-            if sheet in wb.sheetnames:
-                del wb[sheet]
+        # --- Step 1: Line Item Check (whole columns at once) ---
+        _, item_rows = self.workbook.stream("Line_Items")
+        items = pd.DataFrame((row[:8] for row in item_rows), columns=LINE_ITEM_COLUMNS, dtype=object)
+        items = items[items["DocNo"].astype(bool)]
 
-        ws_review = wb.create_sheet("Review_Report")
-        ws_errors = wb.create_sheet("LineItem_Errors")
+        qty = pd.to_numeric(items["Quantity"], errors="coerce")
+        rate = clean_currency(items["Rate"])
+        amount = clean_currency(items["Amount"])
+        computed = qty * rate
+        # Within a paisa counts as a match; NaN on either side never does
+        matched = pd.Series(np.isclose(computed, amount, atol=AMOUNT_TOLERANCE, rtol=0), index=items.index)
 
-        # Headers
-        ws_review.append([
-            "DocNo", "Taxable (from Items)", "GST_Rate (%)",
-            "CGST_calc", "SGST_calc", "ExpectedTotal",
-            "QR_Total (TotInvVal)", "Diff", "InvoiceTotal_OK"
-        ])
-        ws_errors.append([
-            "DocNo", "S.No", "Description", "Quantity", "Rate",
-            "Stored Amount", "Computed Amount", "Match Flag"
-        ])
+        error_rows = _frame_rows(
+            items.loc[~matched, ["DocNo", "S.No", "Description", "Quantity", "Rate", "Amount"]]
+            .assign(Computed=computed[~matched], MatchFlag="❌")
+        )
 
-        # --- Step 1: Line Item Check ---
-        line_totals = {}
-        for row in ws_items.iter_rows(min_row=2, values_only=True):
-            docno, sno, desc, hsn, qty, unit, rate, amount, *_ = row
-            if not docno:
-                continue
-
-            try:
-                computed = float(qty) * float(rate)
-            except Exception:
-                computed = None
-
-            try:
-                amount_f = float(amount) if amount is not None else None
-            except Exception:
-                amount_f = None
-
-            match_flag = "✅" if (
-                computed is not None and amount_f is not None and
-                round(computed, 2) == round(amount_f, 2)
-            ) else "❌"
-
-            if match_flag == "❌":
-                ws_errors.append([docno, sno, desc, qty, rate, amount, computed, match_flag])
-
-            if docno not in line_totals:
-                line_totals[docno] = 0.0
-            if amount_f is not None:
-                line_totals[docno] += amount_f
-            elif computed is not None:
-                line_totals[docno] += computed
+        # Stored amount wins, the computed one fills in where it is missing
+        line_totals = (
+            amount.fillna(computed)
+            .groupby(items["DocNo"], sort=False)
+            .sum()
+            .to_dict()
+        )
 
         # --- Step 2: GST Rate Lookup (from GST_Fetch) ---
-        gst_lookup = {}
-        for row in ws_gst.iter_rows(min_row=2, values_only=True):
-            if len(row) < 8:
-                continue
-            docno, docdt, hsn, description, gst_rate, cgst_rate, sgst_rate, source = row[:8]
-            if docno:
-                gst_lookup[docno] = {
-                    "HSN": hsn,
-                    "Description": description,
-                    "Source": source,
-                    "GST": float(gst_rate) if gst_rate not in (None, "") else None,
-                    "CGST": float(cgst_rate) if cgst_rate not in (None, "") else None,
-                    "SGST": float(sgst_rate) if sgst_rate not in (None, "") else None,
-                }
+        _, gst_rows = self.workbook.stream("GST_Fetch")
+        gst = pd.DataFrame((row[:8] for row in gst_rows if len(row) >= 8), columns=GST_FETCH_COLUMNS, dtype=object)
+        gst = gst[gst["DocNo"].astype(bool)].drop_duplicates("DocNo", keep="last")
+        for col in ("GST", "CGST", "SGST"):
+            gst[col] = pd.to_numeric(gst[col], errors="coerce")
+        gst_lookup = (
+            gst.set_index("DocNo")[["HSN", "Description", "Source", "GST", "CGST", "SGST"]]
+            .to_dict(orient="index")
+        )
 
         # --- Step 3: Invoice Total Check ---
-        summary_lookup = {}
-        totinv_idx = self._find_totinv_column(ws_summary)
+        summary_header, summary_rows = self.workbook.stream("Invoice_Summary")
+        totinv_idx = _find_totinv_column(tuple(summary_header))
         if totinv_idx is None:
-            print("⚠ Could not auto-detect TotInvVal column.")
+            logger.warning("⚠ Could not auto-detect TotInvVal column.")
         else:
-            header_name = ws_summary[1][totinv_idx].value
-            print(f"ℹ TotInvVal column index {totinv_idx} (header: '{header_name}')")
-
-        for row in ws_summary.iter_rows(min_row=2, values_only=True):
-            docno = row[0]
-            if not docno:
-                continue
-            qr_total = self._to_float(row[totinv_idx]) if totinv_idx is not None else None
-            summary_lookup[docno] = qr_total
-
-        # --- Step 4: Compare ---
-        for docno, taxable in line_totals.items():
-            gst_info = gst_lookup.get(docno)
-            qr_total = summary_lookup.get(docno)
-
-            if not gst_info or gst_info.get("CGST") is None or gst_info.get("SGST") is None or qr_total is None:
-                print(f"⚠ Skipping {docno}, missing GST info or QR total.")
-                continue
-
-            cgst_calc = taxable * (gst_info["CGST"] / 100.0)
-            sgst_calc = taxable * (gst_info["SGST"] / 100.0)
-            expected_total = taxable + cgst_calc + sgst_calc
-
-            diff = round(expected_total - float(qr_total), 2)
-            status = "✅" if abs(diff) < 0.01 else "❌"
-
-            ws_review.append([
-                docno, round(taxable, 2), gst_info["GST"],
-                round(cgst_calc, 2), round(sgst_calc, 2),
-                round(expected_total, 2), float(qr_total), diff, status
-            ])
-
-        # --- Step 5: Add "Item Category" column to Line_Items ---
-        headers = [cell.value for cell in ws_items[1]]
-        if "Item Category" not in headers:
-            ws_items.cell(row=1, column=len(headers) + 1, value="Item Category")
-
-        category_col = headers.index("Item Category") + 1 if "Item Category" in headers else len(headers) + 1
-
-        for row_idx, row in enumerate(ws_items.iter_rows(min_row=2, values_only=True), start=2):
-            docno = row[0]
-            if not docno:
-                continue
-            gst_info = gst_lookup.get(docno)
-            if gst_info:
-                ws_items.cell(row=row_idx, column=category_col, value=gst_info.get("Description"))
-
-        wb.save(self.excel_file)
-        wb.close()
-        print(f"📁 Review done. Results in 'Review_Report', 'LineItem_Errors', and 'Line_Items' updated with 'Item Category'.")
+            header_name = summary_header[totinv_idx]
+            logger.info("ℹ TotInvVal column index %d (header: '%s')", totinv_idx, header_name)
+
+        summary = pd.DataFrame(
+            ((row[0], row[totinv_idx] if totinv_idx is not None else None) for row in summary_rows),
+            columns=["DocNo", "QR_Total"], dtype=object,
+        )
+        summary = summary[summary["DocNo"].astype(bool)].drop_duplicates("DocNo", keep="last")
+        summary_lookup = dict(zip(summary["DocNo"], clean_currency(summary["QR_Total"])))
+
+        # --- Step 4: Compare (one frame indexed by DocNo, whole-column math) ---
+        # Float even when there are no rates at all (an empty frame would be object dtype)
+        gst_rates = pd.DataFrame(
+            list(gst_lookup.values()), index=_docno_index(gst_lookup), columns=["GST", "CGST", "SGST"],
+            dtype=float,
+        )
+        review = pd.DataFrame({"taxable": _by_docno(line_totals)}).join([
+            gst_rates, _by_docno(summary_lookup).rename("qr_total"),
+        ])
+
+        # DocNos without GST info or a QR total drop out of the comparison,
+        # reported together in one line rather than one line each
+        missing = review[["CGST", "SGST", "qr_total"]].isna().any(axis=1)
+        skipped = review.index[missing].tolist()
+        if skipped:
+            shown = ", ".join(map(str, skipped[:SKIPPED_SHOWN]))
+            more = f" (+{len(skipped) - SKIPPED_SHOWN} more)" if len(skipped) > SKIPPED_SHOWN else ""
+            logger.warning("⚠ Skipped %d of %d invoices, missing GST info or QR total: %s%s",
+                           len(skipped), len(review), shown, more)
+        review = review[~missing]
+
+        cgst_calc = review["taxable"] * (review["CGST"] / 100.0)
+        sgst_calc = review["taxable"] * (review["SGST"] / 100.0)
+        expected_total = review["taxable"] + cgst_calc + sgst_calc
+        diff = (expected_total - review["qr_total"]).round(2)
+        total_ok = np.isclose(expected_total, review["qr_total"], atol=AMOUNT_TOLERANCE, rtol=0)
+
+        review_rows = _frame_rows(pd.DataFrame({
+            "DocNo": review.index,
+            "taxable": review["taxable"].round(2),
+            "GST": review["GST"],
+            "cgst": cgst_calc.round(2),
+            "sgst": sgst_calc.round(2),
+            "expected": expected_total.round(2),
+            "qr_total": review["qr_total"],
+            "diff": diff,
+            "status": np.where(total_ok, "✅", "❌"),
+        }, index=review.index))
+
+        # --- Step 5: Item Category per DocNo (joined onto Line_Items at read time) ---
+        category_rows = _frame_rows(gst.loc[gst["DocNo"].isin(line_totals.keys()), ["DocNo", "Description"]])
+
+        # --- Step 6: Quality report (audit counts and sums over the whole run) ---
+        quality = {
+            "Line items": len(items),
+            "Invoices with line items": int(items["DocNo"].nunique()),
+            "Unparsed Quantity cells": _unparsed(items["Quantity"], qty),
+            "Unparsed Rate cells": _unparsed(items["Rate"], rate),
+            "Unparsed Amount cells": _unparsed(items["Amount"], amount),
+            "Negative quantities": int((qty < 0).sum()),
+            "Line item mismatches": len(error_rows),
+            "Sum of stored amounts": round(float(amount.sum()), 2),
+            "Sum of computed amounts": round(float(computed.sum()), 2),
+            "Invoices reviewed": len(review),
+            "Invoices skipped": len(skipped),
+            "Invoice total mismatches": int((~total_ok).sum()),
+            "Sum of expected totals": round(float(expected_total.sum()), 2),
+            "Sum of QR totals": round(float(review["qr_total"].sum()), 2),
+        }
+        for check in ("Unparsed Quantity cells", "Unparsed Rate cells", "Unparsed Amount cells", "Negative quantities"):
+            if quality[check]:
+                logger.warning("⚠ %s: %s", check, quality[check])
+
+        # Write phase: the reports go to their own small workbook, so the
+        # (large) invoices workbook is never rewritten by this agent
+        write_workbook(self.review_file, {
+            "Review_Report": (REVIEW_HEADER, review_rows),
+            "LineItem_Errors": (LINE_ITEM_ERRORS_HEADER, error_rows),
+            "Item_Categories": (ITEM_CATEGORIES_HEADER, category_rows),
+            "Quality_Report": (QUALITY_REPORT_HEADER, list(quality.items())),
+        }, xml_sheets=REVIEW_SHEETS if self.fast_writer else ())
+        logger.info("📁 Review done. Results in '%s' (%s).", self.review_file, ", ".join(REVIEW_SHEETS))
+
+
+def run(state=None, fast_writer=False):
+    """Pipeline stage entry point (see pipeline.py)."""
+    if state:
+        fast_writer = state.fast_writer
+    ReviewerAgent(workbook=state.workbook if state else None, fast_writer=fast_writer).process()
 
 
 if __name__ == "__main__":
-    agent = ReviewerAgent()
-    agent.process()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Cross-check invoice totals and line items.")
+    parser.add_argument("--fast-writer", action="store_true",
+                        help="write the review workbook as raw sheet XML (faster for large reports)")
+    run(fast_writer=parser.parse_args().fast_writer)
\ No newline at end of file
@@ -1,9 +1,16 @@
 import os
 import json
+import logging
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import count
 from dotenv import load_dotenv
 from groq import Groq
 
+logger = logging.getLogger(__name__)
+
 # ---------------------------
 # Config
 # ---------------------------
@@ -12,11 +19,21 @@ API_KEY = os.getenv("GROQ_API_KEY")
 LLM_MODEL = os.getenv("LLM_MODEL", "openai/gpt-oss-20b")
 
 INPUT_FILE = "data/outputs/extracted_content.txt"
+VALIDATION_WORKERS = 8  # concurrent LLM requests
+# Pages read ahead of the oldest unwritten one; every 5th page is validated,
+# so this keeps about one request per worker in flight
+MAX_PENDING_PAGES = VALIDATION_WORKERS * 5
+
+# Page banner written by the ingestion agent
+PAGE_RE = re.compile(r"########################################\n# Page (\d+)\n########################################")
 
-if not API_KEY:
-    raise ValueError("❌ GROQ_API_KEY not found in environment variables")
 
-client = Groq(api_key=API_KEY)
+@lru_cache(maxsize=None)
+def get_client() -> Groq:
+    """Create the Groq client on first use (importing this module needs no API key)."""
+    if not API_KEY:
+        raise ValueError("❌ GROQ_API_KEY not found in environment variables")
+    return Groq(api_key=API_KEY)
 
 
 # ---------------------------
@@ -25,6 +42,7 @@ client = Groq(api_key=API_KEY)
 class LLMValidatorAgent:
     def __init__(self, model_name: str = LLM_MODEL):
         self.model_name = model_name
+        self.client = get_client()
 
     def validate_page(self, page_text: str) -> dict:
         system_prompt = (
@@ -42,7 +60,7 @@ class LLMValidatorAgent:
             "Output strictly in JSON only."
         )
         try:
-            response = client.chat.completions.create(
+            response = self.client.chat.completions.create(
                 model=self.model_name,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -59,8 +77,19 @@ class LLMValidatorAgent:
 # ---------------------------
 # Utilities
 # ---------------------------
-def split_into_pages(content: str):
-    return re.split(r"(?=########################################\n# Page \d+\n########################################)", content)
+def iter_pages(path: str):
+    """Stream (page_number, page_text) pairs from a file, split at page banners (None for any preamble)."""
+    page_num, current = None, []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            current.append(line)
+            # A banner is three lines; test the window once its "# Page N" line is in
+            if len(current) >= 3 and current[-2].startswith("# Page"):
+                m = PAGE_RE.match("".join(current[-3:]))
+                if m:
+                    yield page_num, "".join(current[:-3])
+                    page_num, current = int(m.group(1)), current[-3:]
+    yield page_num, "".join(current)
 
 
 def insert_flag_to_page(page_text: str, flag: str) -> str:
@@ -70,50 +99,68 @@ def insert_flag_to_page(page_text: str, flag: str) -> str:
 # ---------------------------
 # Main
 # ---------------------------
-def append_validation():
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        content = f.read()
+def _write_page(out, page: str, future, counter) -> None:
+    """Write one page, with its validation flag appended if it was checked."""
+    if future is not None:
+        invoice_counter = next(counter)
+        result = future.result()
+
+        if result.get("status") == "validated":
+            flag = f"VALIDATION: VALID ✅ (DocNo: {result.get('DocNo')}, TotInvVal: {result.get('TotInvVal')})"
+            logger.info("Invoice %d validated (DocNo: %s)", invoice_counter, result.get('DocNo'))
+        elif result.get("status") == "mismatch":
+            errors = result.get("errors", [])
+            mismatch_info = ", ".join(
+                [f"{e['field']} mismatch" for e in errors]
+            )
+            flag = f"VALIDATION: NOT VALID ❌ (DocNo: {result.get('DocNo')} - {mismatch_info})"
+            logger.info("Invoice %d mismatch", invoice_counter)
+        else:
+            flag = f"VALIDATION: ERROR ⚠️ ({result.get('message', 'Incomplete invoice data')})"
+            logger.info("Invoice %d error", invoice_counter)
+
+        page = insert_flag_to_page(page, flag)
+
+    out.write(page)
 
-    pages = split_into_pages(content)
+
+def append_validation():
     agent = LLMValidatorAgent()
-    validated_pages = []
-
-    invoice_counter = 0
-
-    for page in pages:
-        m = re.search(r"# Page (\d+)", page)
-        if not m:
-            validated_pages.append(page)
-            continue
-
-        page_num = int(m.group(1))
-        if page_num % 5 == 0:  # only multiples of 5
-            invoice_counter += 1
-            result = agent.validate_page(page)
-
-            if result.get("status") == "validated":
-                flag = f"VALIDATION: VALID ✅ (DocNo: {result.get('DocNo')}, TotInvVal: {result.get('TotInvVal')})"
-                print(f"Invoice {invoice_counter} validated (DocNo: {result.get('DocNo')})")
-            elif result.get("status") == "mismatch":
-                errors = result.get("errors", [])
-                mismatch_info = ", ".join(
-                    [f"{e['field']} mismatch" for e in errors]
-                )
-                flag = f"VALIDATION: NOT VALID ❌ (DocNo: {result.get('DocNo')} - {mismatch_info})"
-                print(f"Invoice {invoice_counter} mismatch")
+    counter = count(1)
+    tmp_file = INPUT_FILE + ".tmp"
+
+    # Pages stream from the input into a temp file that replaces it at the end.
+    # Every 5th page is sent to the LLM as soon as it is read; these are
+    # independent network round-trips, so they run concurrently (the Groq
+    # client already retries rate limits with backoff). Pages wait in
+    # `pending` only until the results ahead of them are in, keeping file order;
+    # reading stops MAX_PENDING_PAGES ahead until the oldest result arrives.
+    pending = deque()
+    with open(tmp_file, "w", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=VALIDATION_WORKERS) as executor:
+        for page_num, page in iter_pages(INPUT_FILE):
+            if page_num is not None and page_num % 5 == 0:  # only multiples of 5
+                pending.append((page, executor.submit(agent.validate_page, page)))
             else:
-                flag = f"VALIDATION: ERROR ⚠️ ({result.get('message', 'Incomplete invoice data')})"
-                print(f"Invoice {invoice_counter} error")
+                pending.append((page, None))
 
-            page = insert_flag_to_page(page, flag)
+            while pending and (pending[0][1] is None or pending[0][1].done()):
+                _write_page(out, *pending.popleft(), counter)
+            while len(pending) > MAX_PENDING_PAGES:
+                _write_page(out, *pending.popleft(), counter)  # blocks on its result
 
-        validated_pages.append(page)
+        while pending:
+            _write_page(out, *pending.popleft(), counter)
 
-    with open(INPUT_FILE, "w", encoding="utf-8") as f:
-        f.write("".join(validated_pages))
+    os.replace(tmp_file, INPUT_FILE)
+    logger.info("✅ Validation complete. Results appended directly into %s", INPUT_FILE)
 
-    print(f"\n✅ Validation complete. Results appended directly into {INPUT_FILE}")
+
+def run(state=None):
+    """Pipeline stage entry point (see pipeline.py)."""
+    append_validation()
 
 
 if __name__ == "__main__":
-    append_validation()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    run()
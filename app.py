@@ -1,16 +1,28 @@
 import streamlit as st
-import subprocess
-import sys
-import os
+import logging
+import queue
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import pipeline
+
 # --- Configuration ---
 BASE_DIR = Path(__file__).parent
 INVOICES_DIR = BASE_DIR / "data" / "invoices"
 OUTPUTS_DIR = BASE_DIR / "data" / "outputs"
 EXTRACTED_CONTENT_FILE = OUTPUTS_DIR / "extracted_content.txt"
 FINAL_EXCEL_FILE = OUTPUTS_DIR / "invoices_data.xlsx"
+REVIEW_EXCEL_FILE = OUTPUTS_DIR / "invoices_review.xlsx"
+
+# Agent logs reach the page in blocks: every LOG_FLUSH_LINES records or LOG_FLUSH_SECONDS
+LOG_FLUSH_LINES = 50
+LOG_FLUSH_SECONDS = 0.1
+
+# All stages log under the "agents" package logger, progress at INFO
+AGENT_LOGGER = logging.getLogger("agents")
+AGENT_LOGGER.setLevel(logging.INFO)
 
 # The sequence of agents to run for the pipeline
 PIPELINE_AGENTS = {
@@ -36,38 +48,80 @@ def clear_previous_run_data():
         EXTRACTED_CONTENT_FILE.unlink()
     if FINAL_EXCEL_FILE.exists():
         FINAL_EXCEL_FILE.unlink()
+    if REVIEW_EXCEL_FILE.exists():
+        REVIEW_EXCEL_FILE.unlink()
     # Clear any leftover PDFs from the invoices directory
     for pdf_file in INVOICES_DIR.glob("*.pdf"):
         pdf_file.unlink()
 
-def run_agent(agent_name: str):
+
+class _RunLogHandler(logging.Handler):
     """
-    Runs a specific agent script as a subprocess and yields its output in real-time.
+    Queues the formatted records of one stage run: those logged from its thread
+    or from threads named after it (so concurrent sessions never mix logs).
     """
-    agent_path = BASE_DIR / "agents" / agent_name
-    if not agent_path.exists():
-        st.error(f"Error: Agent script not found at {agent_path}")
-        return
 
-    env = os.environ.copy()
-    env["PYTHONIOENCODING"] = "utf-8"
+    def __init__(self, thread_name: str):
+        super().__init__()
+        self.lines = queue.SimpleQueue()
+        self.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+        self.addFilter(lambda record: record.threadName.startswith(thread_name))
 
-    process = subprocess.Popen(
-        [sys.executable, str(agent_path)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        bufsize=1,
-        env=env
-    )
+    def emit(self, record):
+        try:
+            self.lines.put(self.format(record))
+        except Exception:
+            self.handleError(record)
 
-    for line_bytes in iter(process.stdout.readline, b''):
-        yield line_bytes.decode('utf-8', errors='ignore')
-    
-    process.stdout.close()
-    return_code = process.wait()
-    
-    if return_code != 0:
-        st.error(f"Agent '{agent_name}' failed with return code {return_code}. See logs for details.")
+
+def run_agent(agent_name: str, state: pipeline.PipelineState):
+    """
+    Runs one pipeline stage in a worker thread and yields what it logs as it
+    goes, in blocks of records (one UI update per block instead of per line).
+    """
+    if agent_name not in pipeline.STAGES:
+        st.error(f"Error: Unknown pipeline stage {agent_name}")
+        return
+
+    # The stage thread gets a name of its own, which its handler filters on
+    thread_name = f"stage-{uuid.uuid4().hex}"
+    handler = _RunLogHandler(thread_name)
+    AGENT_LOGGER.addHandler(handler)
+
+    def run_stage():
+        try:
+            pipeline.run_stage(agent_name, state)
+        except Exception:
+            # Into the stage's log, next to its output
+            logging.getLogger(pipeline.STAGES[agent_name]).exception(f"❌ {agent_name} failed")
+            raise
+
+    buffer = []
+    last_flush = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix=thread_name) as pool:
+            future = pool.submit(run_stage)
+            while True:
+                finished = future.done()
+                try:
+                    buffer.append(handler.lines.get(timeout=LOG_FLUSH_SECONDS))
+                except queue.Empty:
+                    pass
+                drained = finished and handler.lines.empty()
+                if buffer and (drained or len(buffer) >= LOG_FLUSH_LINES
+                               or time.monotonic() - last_flush >= LOG_FLUSH_SECONDS):
+                    yield "\n".join(buffer)
+                    buffer.clear()
+                    last_flush = time.monotonic()
+                if drained:
+                    break
+    finally:
+        AGENT_LOGGER.removeHandler(handler)
+
+    failure = future.exception()
+    if failure is not None:
+        state.workbook.save()
+        st.error(f"Agent '{agent_name}' failed: {failure}. See logs for details.")
         st.stop()
 
 # --- Streamlit UI ---
@@ -123,16 +177,20 @@ if process_button and uploaded_files:
     # 3. Execute Pipeline
     st.subheader("Agent Logs")
     
+    # All agents run in this process and share the workbook in memory
+    state = pipeline.PipelineState()
     for i, (agent, description) in enumerate(PIPELINE_AGENTS.items()):
         status_text.info(f"*Running:* {agent} ({description})")
         
         with st.expander(f"Logs for {agent}"):
             with st.spinner(f"Executing {agent}..."):
-                for line in run_agent(agent):
-                    st.text(line.strip())
+                # Each block is added below the last, earlier ones are not redrawn
+                for block in run_agent(agent, state):
+                    st.code(block)
         
         progress_value = (i + 1) / total_agents
         progress_bar.progress(progress_value)
+    state.workbook.save()
     
     status_text.success("Pipeline completed successfully for all invoices.")
 
@@ -150,5 +208,14 @@ if process_button and uploaded_files:
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True
             )
+        if REVIEW_EXCEL_FILE.exists():
+            with open(REVIEW_EXCEL_FILE, "rb") as f:
+                st.download_button(
+                    label="Download Review Report (invoices_review.xlsx)",
+                    data=f,
+                    file_name="invoices_review.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
     else:
         st.error("Processing finished, but the final Excel report was not generated. Please review the agent logs for errors.")
\ No newline at end of file
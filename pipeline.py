@@ -1,63 +1,73 @@
-import subprocess
-import sys
-import os  # <--- ADD THIS LINE
+import argparse
+import importlib
+import logging
+import os
+import traceback
+from dataclasses import dataclass, field
+
 from colorama import init, Fore, Style
 
+from agents.excel_io import InMemoryWorkbook
+
 init(autoreset=True)
 
-def run_agent(agent_name: str):
-    """Runs a Python script as a separate process and prints the output."""
+EXCEL_FILE = os.path.join("data", "outputs", "invoices_data.xlsx")
+
+# The stages in run order, each one an agent module exposing run(state).
+# Modules are imported only when their stage runs, so a missing dependency
+# (e.g. the zbar library behind pyzbar, or groq) fails just that stage
+STAGES = {
+    "ingestion_agent.py": "agents.ingestion_agent",
+    "validation_agent.py": "agents.validation_agent",
+    "logger_agent.py": "agents.logger_agent",
+    "mapper_agent.py": "agents.mapper_agent",
+    "gst_fetcher_agent.py": "agents.gst_fetcher_agent",
+    "reviewer_agent.py": "agents.reviewer_agent",
+}
+
+
+@dataclass
+class PipelineState:
+    """Shared by the stages of one run: the invoices workbook stays in memory between them."""
+    workbook: InMemoryWorkbook = field(default_factory=lambda: InMemoryWorkbook(EXCEL_FILE))
+    # Reviewer reports go out as raw sheet XML (see excel_io.write_workbook)
+    fast_writer: bool = False
+
+
+def run_stage(agent_name: str, state: PipelineState):
+    """Imports one stage's agent module and runs it on the shared state."""
+    importlib.import_module(STAGES[agent_name]).run(state)
+
+
+def run_agent(agent_name: str, state: PipelineState):
+    """Runs one pipeline stage in this process and prints how it went."""
     print(Fore.YELLOW + f"[*] Running {agent_name}...")
     try:
-        # --- START OF CHANGES ---
-        # Set an environment variable to force Python to use UTF-8 for I/O
-        my_env = os.environ.copy()
-        my_env["PYTHONIOENCODING"] = "utf-8"
-        
-        process = subprocess.Popen(
-            [sys.executable, f"agents\\{agent_name}"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding='utf-8',
-            env=my_env  # <-- ADD THIS ARGUMENT
-        )
-        # --- END OF CHANGES ---
-
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                print(output.strip())
-
-        if process.returncode == 0:
-            print(Fore.GREEN + f"[+] {agent_name} finished successfully.\n")
-        else:
-            print(Fore.RED + f"[-] {agent_name} failed with return code {process.returncode}.\n")
-
-    except FileNotFoundError:
-        print(Fore.RED + f"[!] Error: {agent_name} not found. Make sure the script exists in the 'agents' directory.")
+        run_stage(agent_name, state)
+        print(Fore.GREEN + f"[+] {agent_name} finished successfully.\n")
     except Exception as e:
-        print(Fore.RED + f"[!] An unexpected error occurred while running {agent_name}: {e}")
+        print(Fore.RED + f"[-] {agent_name} failed: {e}")
+        traceback.print_exc()
+        print()
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the invoice processing pipeline.")
+    parser.add_argument("--fast-writer", action="store_true",
+                        help="write the review workbook as raw sheet XML (faster for large reports)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
     print(Style.BRIGHT + Fore.CYAN + "===================================")
     print(Style.BRIGHT + Fore.CYAN + "  Running Invoice Processing Pipeline")
     print(Style.BRIGHT + Fore.CYAN + "===================================\n")
 
-    agents_to_run = [
-        "ingestion_agent.py",
-        "validation_agent.py",
-        "logger_agent.py",
-        "mapper_agent.py",
-        "gst_fetcher_agent.py",
-        "reviewer_agent.py"
-    ]
-
-    for agent in agents_to_run:
-        run_agent(agent)
+    # All stages run in this one interpreter; the workbook is written once at the end
+    state = PipelineState(fast_writer=args.fast_writer)
+    for agent in STAGES:
+        run_agent(agent, state)
+    state.workbook.save()
 
     print(Style.BRIGHT + Fore.CYAN + "===================================")
     print(Style.BRIGHT + Fore.CYAN + "  Pipeline finished.")
-    print(Style.BRIGHT + Fore.CYAN + "===================================")
\ No newline at end of file
+    print(Style.BRIGHT + Fore.CYAN + "===================================")
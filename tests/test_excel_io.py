@@ -0,0 +1,87 @@
+import re
+import zipfile
+
+import numpy as np
+from openpyxl import Workbook, load_workbook
+
+from agents.excel_io import read_sheet, read_workbook, update_workbook, write_workbook
+
+
+def _dimensions(path):
+    """{sheet_name: size recorded in the file}, without scanning any rows."""
+    wb = load_workbook(path, read_only=True)
+    try:
+        return {ws.title: (ws.max_row, ws.max_column) for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+
+def test_empty_sheet_reads_as_empty(tmp_path):
+    # Write-only sheets without rows come out without <dimension> or <row> elements
+    path = str(tmp_path / "book.xlsx")
+    wb = Workbook(write_only=True)
+    wb.create_sheet("Empty")
+    wb.create_sheet("Data").append(("a", "b"))
+    wb.save(path)
+
+    assert read_sheet(path, "Empty") == ((), [])
+    assert read_workbook(path) == {"Empty": ((), []), "Data": (("a", "b"), [])}
+
+    update_workbook(path, {"New": (("x",), [(1,)])})
+    assert read_sheet(path, "New") == (("x",), [(1,)])
+
+
+def test_written_sheets_record_their_dimension(tmp_path):
+    path = str(tmp_path / "book.xlsx")
+    write_workbook(path, {
+        "Plain": (("a", "b"), [(1, 2), (3,)]),
+        "Raw": (("a",), [(1, 2, 3)]),
+    }, xml_sheets=("Raw",))
+    assert _dimensions(path) == {"Plain": (3, 2), "Raw": (2, 3)}
+
+    # Sheets carried over by an update keep their recorded size
+    update_workbook(path, {"Extra": (("z",), [])})
+    assert _dimensions(path) == {"Plain": (3, 2), "Raw": (2, 3), "Extra": (1, 1)}
+    assert read_sheet(path, "Plain") == (("a", "b"), [(1, 2), (3, None)])
+
+    with zipfile.ZipFile(path) as archive:
+        assert all(
+            b"<dimension" in archive.read(name)
+            for name in archive.namelist() if name.startswith("xl/worksheets/")
+        )
+
+
+def test_stale_dimension_is_not_trusted(tmp_path):
+    # A 5x3 sheet whose file claims it is a single cell
+    path = str(tmp_path / "book.xlsx")
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Data"
+    ws.append(("a", "b", "c"))
+    for i in range(4):
+        ws.append((i, i * 2) if i % 2 else (i, i * 2, i * 3))
+    wb.save(str(tmp_path / "good.xlsx"))
+    with zipfile.ZipFile(str(tmp_path / "good.xlsx")) as src, zipfile.ZipFile(path, "w") as dst:
+        for info in src.infolist():
+            data = src.read(info)
+            if info.filename.startswith("xl/worksheets/"):
+                data, found = re.subn(rb'<dimension ref="A1:C5"\s*/>', b'<dimension ref="A1"/>', data)
+                assert found == 1
+            dst.writestr(info, data)
+
+    assert read_sheet(path, "Data") == (
+        ("a", "b", "c"), [(0, 0, 0), (1, 2, None), (2, 4, 6), (3, 6, None)]
+    )
+
+    update_workbook(path, {"Extra": (("z",), [])})
+    assert _dimensions(path)["Data"] == (5, 3)
+
+
+def test_raw_xml_numbers_match_openpyxl(tmp_path):
+    row = (1, 2.5, float("nan"), float("inf"), np.int64(5), np.float64(0.1), True)
+    path = str(tmp_path / "book.xlsx")
+    write_workbook(path, {"Raw": (("a",), [row]), "Plain": (("a",), [row])}, xml_sheets=("Raw",))
+
+    wb = load_workbook(path)  # a full load parses every cell value
+    assert [c.value for c in wb["Raw"][2]] == [1, 2.5, None, None, 5, 0.1, True]
+    assert read_sheet(path, "Raw") == read_sheet(path, "Plain")
@@ -0,0 +1,22 @@
+from agents.logger_agent import LoggerAgent
+
+
+def _header(tmp_path, monkeypatch, block):
+    monkeypatch.chdir(tmp_path)
+    summary, _, _ = LoggerAgent(excel_file=str(tmp_path / "invoices.xlsx"))._parse_invoice(block)
+    return {key: summary[key] for key in ("PlaceOfSupply", "Transport", "VehicleNo")}
+
+
+def test_fields_after_place_of_supply_on_one_line(tmp_path, monkeypatch):
+    header = _header(
+        tmp_path, monkeypatch,
+        "Place of Supply : Uttar Pradesh (09)   Transport : SELF   Vehicle No. : UP38T8608\n",
+    )
+    assert header["PlaceOfSupply"].startswith("Uttar Pradesh (09)")
+    assert header["Transport"] == "SELF"
+    assert header["VehicleNo"] == "UP38T8608"
+
+
+def test_blank_place_of_supply_keeps_next_label(tmp_path, monkeypatch):
+    header = _header(tmp_path, monkeypatch, "Place of Supply\n:\nTransport      \n: SELF\n")
+    assert header == {"PlaceOfSupply": None, "Transport": "SELF", "VehicleNo": None}
@@ -0,0 +1,113 @@
+from openpyxl import Workbook, load_workbook
+
+from agents.reviewer_agent import ReviewerAgent, _find_totinv_column
+
+SUMMARY_HEADER = (
+    "DocNo", "DocDt", "SellerGstin", "BuyerGstin", "VendorName", "AckNo",
+    "EWayBill", "PlaceOfSupply", "VehicleNo", "Transport", "ItemCnt(QR)", "TotInvVal(QR)",
+)
+LINE_ITEMS_HEADER = ("DocNo", "S.No", "Description", "HSN", "Quantity", "Unit", "Rate", "Amount")
+GST_FETCH_HEADER = ("DocNo", "DocDt", "HSN", "Description", "GST_Rate(%)", "CGST(%)", "SGST(%)", "Source")
+
+
+def _invoice_workbook(path, items, gst, summary):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Invoice_Summary"
+    ws.append(SUMMARY_HEADER)
+    for docno, total in summary:
+        ws.append([docno, "01/01/2025", "G", "B", "V", None, None, None, None, None, 1, total])
+    for name, header, rows in (("Line_Items", LINE_ITEMS_HEADER, items), ("GST_Fetch", GST_FETCH_HEADER, gst)):
+        ws = wb.create_sheet(name)
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+
+
+def _sheets(path):
+    """{sheet_name: rows} of a saved workbook, header included."""
+    wb = load_workbook(path, read_only=True)
+    try:
+        return {ws.title: list(ws.iter_rows(values_only=True)) for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+
+def _review(tmp_path, items, gst, summary):
+    """Run the reviewer on a fresh workbook; {sheet_name: data rows} of its reports."""
+    path = str(tmp_path / "invoices_data.xlsx")
+    review_path = str(tmp_path / "invoices_review.xlsx")
+    _invoice_workbook(path, items, gst, summary)
+    ReviewerAgent(excel_file=path, review_file=review_path).process()
+    return {name: rows[1:] for name, rows in _sheets(review_path).items()}
+
+
+def test_matching_line_items_leave_no_errors(tmp_path):
+    sheets = _review(
+        tmp_path,
+        items=[("A1", 1, "x", "1", 2, "Pcs", 500, 1000), ("A1", 2, "y", "1", 1, "Pcs", 180, 180)],
+        gst=[("A1", "d", "1", "Utensils", 18, 9, 9, "c")],
+        summary=[("A1", 1392.4)],
+    )
+    assert sheets["LineItem_Errors"] == []
+    assert sheets["Review_Report"] == [("A1", 1180, 18, 106.2, 106.2, 1392.4, 1392.4, 0, "✅")]
+
+
+def test_mismatching_line_item_is_reported(tmp_path):
+    sheets = _review(
+        tmp_path,
+        items=[("A1", 1, "x", "1", 2, "Pcs", 500, 1000), ("A2", 1, "y", "1", 2, "Pcs", 500, 999)],
+        gst=[("A1", "d", "1", "Utensils", 18, 9, 9, "c"), ("A2", "d", "1", "Utensils", 18, 9, 9, "c")],
+        summary=[("A1", 1180), ("A2", 1178.82)],
+    )
+    assert sheets["LineItem_Errors"] == [("A2", 1, "y", 2, 500, 999, 1000, "❌")]
+
+
+def test_reports_left_in_the_invoices_workbook_are_removed(tmp_path):
+    path = str(tmp_path / "invoices_data.xlsx")
+    _invoice_workbook(
+        path,
+        items=[("A1", 1, "x", "1", 2, "Pcs", 500, 1000, "Old category")],
+        gst=[("A1", "d", "1", "Utensils", 18, 9, 9, "c")],
+        summary=[("A1", 1180)],
+    )
+    wb = load_workbook(path)
+    wb["Line_Items"]["I1"] = "Item Category"
+    wb.create_sheet("Review_Report").append(("DocNo", "stale"))
+    wb.create_sheet("LineItem_Errors").append(("DocNo", "stale"))
+    wb.save(path)
+
+    ReviewerAgent(excel_file=path, review_file=str(tmp_path / "invoices_review.xlsx")).process()
+
+    sheets = _sheets(path)
+    assert list(sheets) == ["Invoice_Summary", "Line_Items", "GST_Fetch"]
+    assert sheets["Line_Items"] == [LINE_ITEMS_HEADER, ("A1", 1, "x", "1", 2, "Pcs", 500, 1000)]
+
+
+def test_empty_gst_fetch_skips_every_invoice(tmp_path):
+    sheets = _review(
+        tmp_path,
+        items=[("A1", 1, "x", "1", 2, "Pcs", 500, 1000)],
+        gst=[],
+        summary=[("A1", 1180)],
+    )
+    assert sheets["Review_Report"] == []
+    assert sheets["Item_Categories"] == []
+
+
+def test_empty_line_items_give_empty_reports(tmp_path):
+    sheets = _review(
+        tmp_path,
+        items=[],
+        gst=[("A1", "d", "1", "Utensils", 18, 9, 9, "c")],
+        summary=[("A1", 1180)],
+    )
+    assert sheets["Review_Report"] == []
+    assert sheets["LineItem_Errors"] == []
+
+
+def test_totinv_column_skips_item_counts():
+    assert _find_totinv_column(SUMMARY_HEADER) == 11
+    assert _find_totinv_column(("DocNo", "Total Items", "Invoice Total", "TotInvVal")) == 3
+    assert _find_totinv_column(("DocNo", "Total Items")) is None
@@ -0,0 +1,43 @@
+import json
+import time
+from types import SimpleNamespace
+
+from agents import validation_agent
+
+PAGES = 17
+BANNER = "#" * 40
+
+
+class _SlowClient:
+    """Stands in for the Groq client; earlier pages answer later, so results finish out of order."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, temperature):
+        page = int(messages[1]["content"].split("Invoice D")[1].split()[0])
+        time.sleep((PAGES - page) * 0.01)
+        content = json.dumps({"status": "validated", "DocNo": f"D{page}", "TotInvVal": page})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def test_pages_keep_their_order_and_flags(tmp_path, monkeypatch):
+    path = tmp_path / "extracted_content.txt"
+    path.write_text("=== Extracted from a.pdf ===\n" + "".join(
+        f"\n{BANNER}\n# Page {n}\n{BANNER}\nInvoice D{n} text\n" for n in range(1, PAGES + 1)
+    ), encoding="utf-8")
+    monkeypatch.setattr(validation_agent, "INPUT_FILE", str(path))
+    monkeypatch.setattr(validation_agent, "MAX_PENDING_PAGES", 4)  # exercise the back-pressure
+    monkeypatch.setattr(validation_agent, "get_client", _SlowClient)
+
+    validation_agent.append_validation()
+
+    assert [p.name for p in tmp_path.iterdir()] == ["extracted_content.txt"]  # temp file swapped in
+    pages = list(validation_agent.iter_pages(str(path)))
+    assert [n for n, _ in pages] == [None, *range(1, PAGES + 1)]
+    for n, text in pages[1:]:
+        assert f"Invoice D{n} text" in text
+        flagged = "VALIDATION:" in text
+        assert flagged == (n % 5 == 0)
+        if flagged:
+            assert f"VALIDATION: VALID ✅ (DocNo: D{n}, TotInvVal: {n})" in text